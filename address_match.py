@@ -0,0 +1,262 @@
+"""Address normalisation and matching within postcode blocks.
+
+UPRN extraction only finds numbers someone typed into Notes; match_uprns()
+fills the rest from a reference file such as an AddressBase extract: a CSV
+with a UPRN column, a postcode column and either one address column or
+AddressBase's building and street fields. near_duplicates() uses the same
+normalisation and scoring to find the same property written two ways in
+one export.
+
+Candidates are blocked by postcode. The reference is sorted by
+postcode_keys() once per process and np.searchsorted finds each postcode's
+rows, so an address is only compared with the few dozen sharing its
+postcode; the reference's addresses are tokenised when it is loaded. The
+score is the Jaccard overlap of the two addresses' normalised words, and
+their house/flat numbers must agree exactly.
+"""
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+
+from postcode_index import normalize_postcodes, postcode_keys
+
+REFERENCE_PATH = os.environ.get("ASANA_CLEANER_ADDRESSES", "uprn_addresses.csv")
+
+CONFIDENCE_COLUMN = "UPRN Match Confidence"
+FROM_NOTES        = "notes"   # confidence shown for UPRNs typed into Notes
+MIN_CONFIDENCE    = 0.5
+FUZZY_THRESHOLD   = 0.75    # "12 High St" vs "12 High Street Watford" scores 0.75
+MERGE_COLUMNS     = ["Address", "Merged Into", "Similarity"]
+
+POSTCODE_COLUMNS = ("postcode_locator", "postcode", "pcds", "post_code")
+ADDRESS_COLUMNS  = ("address", "full_address", "single_line_address")
+ADDRESS_PARTS    = ("sao_text", "sub_building_name", "building_name", "pao_text",
+                    "building_number", "pao_start_number", "thoroughfare", "street_description")
+
+ABBREVIATIONS = {
+    "ST": "STREET", "RD": "ROAD", "AVE": "AVENUE", "AV": "AVENUE", "LN": "LANE",
+    "DR": "DRIVE", "CL": "CLOSE", "CT": "COURT", "CRES": "CRESCENT", "GDNS": "GARDENS",
+    "GRN": "GREEN", "GRV": "GROVE", "PL": "PLACE", "SQ": "SQUARE", "TER": "TERRACE",
+    "TERR": "TERRACE", "PK": "PARK", "HSE": "HOUSE", "CTG": "COTTAGE", "APT": "FLAT",
+    "APARTMENT": "FLAT",
+}
+
+
+def address_tokens(addresses, postcodes):
+    """(row, token) pairs: each address's words without its own postcode.
+
+    Words are upper-cased and split on punctuation (apostrophes dropped:
+    "John's" is "JOHNS"). "12 A" becomes "12A",
+    common street abbreviations are expanded and repeats dropped. `row` is
+    the position in `addresses`; `postcodes` are aligned, normalised postcodes.
+    """
+    words = (addresses.fillna("").str.upper()
+             .str.replace(r"['’]", "", regex=True)
+             .str.replace(r"[^A-Z0-9]+", " ", regex=True)
+             .str.replace(r"\b(\d+) ([A-Z])\b", r"\1\2", regex=True)
+             .str.split())
+    tokens = pd.Series(words.to_numpy(), dtype=object).explode().dropna()
+    rows   = tokens.index.to_numpy()
+    tokens = tokens.replace(ABBREVIATIONS).to_numpy(dtype=object)
+
+    postcodes = postcodes.fillna("")
+    outward   = postcodes.str[:-4].to_numpy(dtype=object)[rows]
+    inward    = postcodes.str[-3:].to_numpy(dtype=object)[rows]
+    own       = (tokens == outward) | (tokens == inward) | (tokens == outward + inward)
+    pairs     = pd.DataFrame({"row": rows[~own], "token": tokens[~own]})
+    return pairs.drop_duplicates(ignore_index=True)
+
+
+def similar_pairs(left, right, left_blocks, right_blocks):
+    """Jaccard score of every (left row, right row) pair in the same block.
+
+    `left` / `right` are address_tokens() frames and `*_blocks` the block
+    (postcode) of each of their rows. Only pairs that share a word and
+    whose number-bearing words ("12", "12A", "3") are identical are
+    returned, as a frame of left, right and score.
+    """
+    n_left, n_right = len(left_blocks), len(right_blocks)
+    if left.empty or right.empty:
+        return pd.DataFrame({"left": np.empty(0, np.int64), "right": np.empty(0, np.int64),
+                             "score": np.empty(0)})
+    blocks = pd.factorize(np.concatenate([
+        np.asarray(left_blocks)[left["row"].to_numpy()],
+        np.asarray(right_blocks)[right["row"].to_numpy()],
+    ]))[0].astype(np.int64)
+    tokens, vocabulary = pd.factorize(pd.concat([left["token"], right["token"]], ignore_index=True))
+    key = blocks * len(vocabulary) + tokens
+
+    numeric = pd.Series(vocabulary).str.contains(r"\d", regex=True).to_numpy()
+    pairs   = pd.merge(
+        pd.DataFrame({"key": key[:len(left)], "left": left["row"].to_numpy()}),
+        pd.DataFrame({"key": key[len(left):], "right": right["row"].to_numpy()}),
+        on="key",
+    )
+    pair_id = pairs["left"].to_numpy(dtype=np.int64) * n_right + pairs["right"].to_numpy()
+    shares  = pd.DataFrame({"pair": pair_id, "numeric": numeric[pairs["key"] % len(vocabulary)]})
+    counts  = shares.groupby("pair")["numeric"].agg(["size", "sum"])
+
+    left_rows, right_rows = np.divmod(counts.index.to_numpy(), n_right)
+    left_numeric  = np.bincount(left["row"], numeric[tokens[:len(left)]], minlength=n_left)
+    right_numeric = np.bincount(right["row"], numeric[tokens[len(left):]], minlength=n_right)
+    left_size     = np.bincount(left["row"], minlength=n_left)
+    right_size    = np.bincount(right["row"], minlength=n_right)
+
+    shared = counts["size"].to_numpy()
+    agree  = ((counts["sum"].to_numpy() == left_numeric[left_rows])
+              & (left_numeric[left_rows] == right_numeric[right_rows]))
+    score  = shared / (left_size[left_rows] + right_size[right_rows] - shared)
+    return pd.DataFrame({"left": left_rows, "right": right_rows, "score": score})[agree]
+
+
+def address_keys(addresses, postcodes):
+    """Normalised key per address: its address_tokens() in order, then its
+    postcode, so "12 High St, ab12cd" and "12 HIGH STREET AB1 2CD" agree."""
+    tokens = address_tokens(addresses, postcodes)
+    rows   = tokens["row"].to_numpy()
+    words  = np.full(len(addresses), "", dtype=object)
+    if len(rows):   # tokens come grouped by row, so each row's words are one run
+        starts = np.flatnonzero(np.diff(rows, prepend=-1))
+        words[rows[starts]] = np.add.reduceat(tokens["token"].to_numpy(dtype=object) + " ", starts)
+    return pd.Series(words + postcodes.fillna("").to_numpy(dtype=object), index=addresses.index)
+
+
+def near_duplicates(addresses, postcodes, threshold=FUZZY_THRESHOLD):
+    """Which addresses repeat an earlier one once normalised or nearly so.
+
+    Addresses with the same address_keys() are duplicates outright; distinct
+    keys in the same postcode are near-duplicates when similar_pairs()
+    scores them at least `threshold`. An address merges into the earliest
+    similar one, followed back to an address that is not itself a duplicate.
+
+    Returns (duplicate, merged_into, similarity) numpy arrays aligned to
+    `addresses`: a bool mask, the position each row merges into (its own
+    for rows kept), and the score that merged it (1.0 for equal keys).
+    """
+    postcodes    = postcodes.fillna("")
+    codes, keys  = pd.factorize(address_keys(addresses, postcodes))
+    first        = np.unique(codes, return_index=True)[1]
+    key_postcode = postcode_keys(postcodes.iloc[first])
+
+    target = np.arange(len(keys))
+    score  = np.ones(len(keys))
+    tokens = address_tokens(pd.Series(keys, dtype=object), postcodes.iloc[first])
+    pairs  = similar_pairs(tokens, tokens, key_postcode, key_postcode)
+    pairs  = pairs[(pairs["left"] < pairs["right"]) & (pairs["score"] >= threshold)]
+    pairs  = pairs.sort_values(["right", "left"]).drop_duplicates("right")
+    target[pairs["right"].to_numpy()] = pairs["left"].to_numpy()
+    score[pairs["right"].to_numpy()]  = pairs["score"].to_numpy()
+    while (target[target] != target).any():
+        target = target[target]
+
+    merged_into = first[target[codes]]
+    return merged_into != np.arange(len(codes)), merged_into, score[codes]
+
+
+def merge_report(addresses, duplicate, merged_into, similarity):
+    """MERGE_COLUMNS frame listing each near-duplicate and what it merged into."""
+    values = addresses.to_numpy(dtype=object)
+    return pd.DataFrame({
+        "Address":     values[duplicate],
+        "Merged Into": values[merged_into[duplicate]],
+        "Similarity":  pd.Series(similarity[duplicate]).map("{:.2f}".format).to_numpy(dtype=object),
+    }, columns=MERGE_COLUMNS, dtype=str)
+
+
+def _reference_columns(columns):
+    """(uprn, postcode, address, parts) column names of a reference file."""
+    lower    = {c.lower().strip(): c for c in columns}
+    postcode = next((lower[c] for c in POSTCODE_COLUMNS if c in lower), None)
+    address  = next((lower[c] for c in ADDRESS_COLUMNS if c in lower), None)
+    parts    = [lower[c] for c in ADDRESS_PARTS if c in lower]
+    if "uprn" not in lower or not postcode or not (address or parts):
+        raise ValueError("Address file needs UPRN, postcode and address (or AddressBase "
+                         "building/street) columns.")
+    return lower["uprn"], postcode, address, parts
+
+
+def _ranges(starts, counts):
+    """np.arange(start, start + count) for each pair, concatenated."""
+    return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+
+class AddressReference:
+    """A reference file sorted by postcode, its addresses tokenised up front."""
+
+    def __init__(self, frame):
+        self.frame   = frame
+        self.keys    = frame["key"].to_numpy()
+        self.tokens  = address_tokens(frame["address"], frame["postcode"])
+        self.offsets = np.searchsorted(self.tokens["row"].to_numpy(), np.arange(len(frame) + 1))
+
+    def __len__(self):
+        return len(self.frame)
+
+    def candidates(self, keys):
+        """(rows, tokens) of every reference address sharing a postcode key
+        with `keys`; the tokens' `row` is renumbered to positions in rows."""
+        blocks = np.unique(keys)
+        starts = np.searchsorted(self.keys, blocks, "left")
+        counts = np.searchsorted(self.keys, blocks, "right") - starts
+        token_starts = self.offsets[starts]
+        token_counts = self.offsets[starts + counts] - token_starts
+        tokens = self.tokens.iloc[_ranges(token_starts, token_counts)]
+        shift  = np.repeat(np.cumsum(counts) - counts - starts, token_counts)
+        return _ranges(starts, counts), tokens.assign(row=tokens["row"].to_numpy() + shift)
+
+
+@functools.lru_cache(maxsize=2)
+def _load(path, mtime):
+    uprn, postcode, address, parts = _reference_columns(pd.read_csv(path, nrows=0).columns)
+    usecols = [uprn, postcode] + ([address] if address else parts)
+    raw     = pd.read_csv(path, usecols=usecols, dtype=str, keep_default_na=False)
+    text    = raw[address] if address else \
+        raw[parts[0]].str.cat([raw[p] for p in parts[1:]], sep=" ")
+
+    postcodes = normalize_postcodes(raw[postcode])
+    reference = pd.DataFrame({
+        "key":      postcode_keys(postcodes),
+        "postcode": postcodes,
+        "uprn":     raw[uprn].str.strip(),
+        "address":  text,
+    })
+    reference = reference[(postcodes.str.len() > 5) & (reference["uprn"] != "")]
+    return AddressReference(reference.sort_values("key", kind="stable", ignore_index=True))
+
+
+def load_reference(path=REFERENCE_PATH):
+    """The AddressReference for an address/UPRN file, built once per process and file version."""
+    path = os.path.abspath(path)
+    return _load(path, os.path.getmtime(path))
+
+
+def match_uprns(reference, addresses, postcodes):
+    """Best reference UPRN and its confidence (0–1) for each address.
+
+    Returns a frame of strings aligned to `addresses` with UPRN Number and
+    CONFIDENCE_COLUMN; both are blank when no candidate in the address's
+    postcode scores MIN_CONFIDENCE or the best score is shared by
+    different UPRNs.
+    """
+    result = pd.DataFrame({"UPRN Number": "", CONFIDENCE_COLUMN: ""},
+                          index=addresses.index, dtype=object)
+    postcodes = postcodes.fillna("")
+    keys      = postcode_keys(postcodes)
+    rows, candidate_tokens = reference.candidates(keys)
+    if not len(rows):
+        return result
+
+    pairs = similar_pairs(address_tokens(addresses, postcodes), candidate_tokens,
+                          keys, reference.keys[rows])
+    pairs = pairs[pairs["score"] >= MIN_CONFIDENCE]
+    pairs = pairs.assign(uprn=reference.frame["uprn"].to_numpy()[rows[pairs["right"].to_numpy()]])
+    best  = pairs[pairs["score"] == pairs.groupby("left")["score"].transform("max")]
+    best  = best.drop_duplicates(["left", "uprn"])
+    best  = best[~best["left"].duplicated(keep=False)]
+
+    matched = best["left"].to_numpy()
+    result.iloc[matched, 0] = best["uprn"].to_numpy()
+    result.iloc[matched, 1] = best["score"].map("{:.2f}".format).to_numpy()
+    return result
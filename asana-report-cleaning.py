@@ -1,7 +1,48 @@
 import streamlit as st
 import pandas as pd
+import functools
 import io
-import re
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from asana_cleaner import (
+    OUTPUT_FORMATS,
+    PREVIEW_MB,
+    STREAM_THRESHOLD_MB,
+    CleanOptions,
+    StageProfiler,
+    auto_detect_columns,
+    clean_asana_export,
+    clean_csv_streaming,
+    clean_export_file,
+    combine_stats,
+    dedupe_across_files,
+    detect_custom_fields,
+    export_size,
+    merge_cleaned,
+    log_run,
+    output_bytes,
+    output_file_name,
+    output_formats,
+    perf_log,
+    postcode_check_stats,
+    preview_export,
+    read_export,
+    read_header,
+    uprn_counts,
+    zip_cleaned,
+)
+import address_match
+import postcode_index
+from incremental import AddressIndex, clean_incremental
+from sharding import spawn_pool
+from jobs import DONE, FAILED, JobCancelled, JobProfiler, JobQueue, job_memory
+from result_cache import ResultCache, content_digest
 
 # ═══════════════════════════════════════════════════════════════════════════════
 #  THEME STATE
@@ -9,10 +50,6 @@ import re
 if "dark_mode" not in st.session_state:
     st.session_state.dark_mode = True
 
-def _toggle_theme():
-    """Callback: fires BEFORE rerun so session_state is correct when CSS is built."""
-    st.session_state.dark_mode = st.session_state._theme_toggle
-
 st.set_page_config(
     page_title="CPH Retrofit — CSV Cleaner",
     page_icon="🏠",
@@ -20,6 +57,320 @@ st.set_page_config(
     initial_sidebar_state="collapsed",
 )
 
+# ═══════════════════════════════════════════════════════════════════════════════
+#  RESULT CACHE
+# ═══════════════════════════════════════════════════════════════════════════════
+RESULT_CACHE_MB = 512   # shared by every session on this server process
+
+@st.cache_resource
+def _result_cache():
+    """One LRU cache per server process: headers, parsed frames, cleaned output."""
+    return ResultCache(max_bytes=RESULT_CACHE_MB * 1024 * 1024)
+
+@st.cache_resource
+def _perf_logging():
+    """Send the per-run JSON lines to stderr once per server process."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    perf_log.addHandler(handler)
+    perf_log.setLevel(logging.INFO)
+    perf_log.propagate = False
+
+_perf_logging()
+
+MAX_CLEAN_WORKERS = 4   # processes shared by all sessions for multi-file cleans
+
+@st.cache_resource
+def _worker_pool():
+    """Process pool for multi-file cleaning; its spawned workers don't re-run this app."""
+    return spawn_pool(min(MAX_CLEAN_WORKERS, os.cpu_count() or 1))
+
+MAX_CLEAN_JOBS   = 2     # cleans running at once across all sessions; the rest queue
+JOB_MEMORY_MB    = int(os.environ.get("ASANA_CLEANER_JOB_MEMORY_MB", 2048))
+JOB_POLL_SECONDS = 0.5
+
+@st.cache_resource
+def _job_queue():
+    """Bounded, memory-aware queue of cleaning jobs shared by every session."""
+    return JobQueue(MAX_CLEAN_JOBS, JOB_MEMORY_MB * 1024 * 1024)
+
+def _clean_uploads(files, options, cache, job, retry=True):
+    """Clean (name, digest, bytes) files on the worker pool, reusing cached frames.
+
+    Reports each finished file to `job`; once it is cancelled, files not yet
+    started are dropped. If a worker dies the pool is rebuilt and the files
+    not yet cleaned are retried once. Returns cleaned frames, per-file stats
+    and stage records in upload order.
+    """
+    try:
+        return _clean_on_pool(files, options, cache, job)
+    except BrokenProcessPool:
+        if not retry:
+            raise
+        _worker_pool().shutdown(wait=False, cancel_futures=True)
+        _worker_pool.clear()
+        return _clean_uploads(files, options, cache, job, retry=False)
+
+def _clean_on_pool(files, options, cache, job):
+    results = [cache.get(("cleaned", digest, options)) for _, digest, _ in files]
+    futures = {
+        _worker_pool().submit(clean_export_file, data, options): i
+        for i, ((_, _, data), cached) in enumerate(zip(files, results))
+        if cached is None
+    }
+    remaining = set(futures)
+    while remaining:
+        job.update(chunk=len(files) - len(remaining), fraction=1 - len(remaining) / len(files))
+        finished, remaining = wait(remaining, timeout=JOB_POLL_SECONDS, return_when=FIRST_COMPLETED)
+        if job.cancel_requested:
+            for future in remaining:
+                future.cancel()
+            raise JobCancelled()
+        for future in finished:
+            name, digest, data = files[futures[future]]
+            cleaned, stats, profiler = future.result()
+            log_run(profiler, stats, file=name, bytes=len(data),
+                    digest=digest[:12], streaming=False)
+            results[futures[future]] = (cleaned, stats,
+                                        [{**r, "file": name} for r in profiler.stages])
+            cache.put(("cleaned", digest, options), results[futures[future]])
+    frames, stats, stages = zip(*results)
+    return list(frames), list(stats), [r for file_stages in stages for r in file_stages]
+
+def _format_picker(key=None):
+    """Output format selector; returns a key of OUTPUT_FORMATS."""
+    return st.radio(
+        "Output format",
+        output_formats(),
+        format_func=lambda fmt: OUTPUT_FORMATS[fmt][0],
+        horizontal=True,
+        key=key,
+    )
+
+def _fuzzy_dedup_checkbox():
+    return st.checkbox(
+        "Merge near-duplicate addresses",
+        value=False,
+        help="Also treats addresses as duplicates when they match after normalising "
+             "case, punctuation, abbreviations (St → Street) and postcode spacing, or "
+             "are nearly identical within the same postcode.",
+    )
+
+def _reference_data_options(extract_uprn):
+    """CleanOptions fields for the local reference files (ONSPD index,
+    address/UPRN file); each is offered only when its file exists."""
+    fields = {}
+    if os.path.exists(address_match.REFERENCE_PATH) and st.checkbox(
+        "Fill missing UPRNs from the local address file",
+        value=False,
+        disabled=not extract_uprn,
+        help="Matches addresses without a UPRN in Notes against the address/UPRN file "
+             "within their postcode and adds a match-confidence column.",
+    ) and extract_uprn:
+        fields["uprn_addresses"] = address_match.REFERENCE_PATH
+    if os.path.exists(postcode_index.INDEX_PATH) and st.checkbox(
+        "Validate postcodes against the ONS Postcode Directory",
+        value=False,
+        help="Adds a Postcode Status column: live, terminated or not found.",
+    ):
+        fields["postcode_index"]   = postcode_index.INDEX_PATH
+        fields["postcode_details"] = st.checkbox(
+            "Add local authority and lat/long",
+            value=False,
+            help="Adds the ONSPD local authority code, latitude and longitude of each postcode.",
+        )
+    return fields
+
+def _reference_data_parts(stats):
+    """Alert fragments for the reference-file steps that ran."""
+    parts = []
+    if "uprn_filled" in stats:
+        parts.append(f"{stats['uprn_filled']:,} UPRNs matched by address")
+    if "postcodes_not_found" in stats:
+        parts += [f"{stats['postcodes_not_found']:,} postcodes not found",
+                  f"{stats['postcodes_terminated']:,} terminated"]
+    return parts
+
+def _upload_digest(uploaded_file):
+    """Content hash of the upload, memoised per file so reruns don't re-hash it."""
+    digests = st.session_state.setdefault("_upload_digests", {})
+    if uploaded_file.file_id not in digests:
+        digests[uploaded_file.file_id] = content_digest(uploaded_file.getbuffer())
+    return digests[uploaded_file.file_id]
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  BACKGROUND JOBS
+# ═══════════════════════════════════════════════════════════════════════════════
+def _submit_job(slot, fn, memory_bytes, shown):
+    """Queue `fn` for this session, replacing (and cancelling) the job in `slot`.
+
+    `shown` is kept with the job and becomes the session's result once it is
+    done. Returns False, with a warning shown, if the job is too big to admit.
+    """
+    queue    = _job_queue()
+    previous = st.session_state.pop(slot, None)
+    if previous is not None:
+        queue.cancel(previous["job"])
+    try:
+        job = queue.submit(fn, memory_bytes)
+    except ValueError as exc:
+        st.markdown(f'<div class="alert alert-warn">⚠️ {exc}</div>', unsafe_allow_html=True)
+        return False
+    st.session_state[slot] = {**shown, "job": job}
+    return True
+
+def _progress_text(pending, job):
+    progress = job.progress
+    if "files" in pending:
+        return f"Cleaning {pending['files']} exports — {progress['chunk']} done"
+    text = f"Cleaning — {progress['stage'] or 'starting'}"
+    if pending.get("streaming") and progress["chunk"]:
+        text += f" · chunk {progress['chunk']:,} · {progress['rows']:,} rows read"
+    return text
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def _job_progress(slot):
+    """Queue position or live progress of the job in `slot`, with a Cancel button.
+
+    Polls until the job finishes, then reruns the app so _job_status can
+    hand its result to the results and download sections.
+    """
+    pending = st.session_state.get(slot)
+    if pending is None:
+        return
+    job = pending["job"]
+    if job.finished:
+        st.rerun()
+
+    ahead = _job_queue().position(job)
+    if job.cancel_requested:
+        st.progress(job.progress["fraction"], text="Cancelling…")
+    elif ahead is not None:
+        st.progress(0.0, text=f"Queued — {ahead} job(s) ahead of yours" if ahead
+                         else "Queued — next in line")
+    else:
+        st.progress(job.progress["fraction"], text=_progress_text(pending, job))
+    st.button("✕  Cancel", key=f"{slot}_cancel", disabled=job.cancel_requested,
+              on_click=_job_queue().cancel, args=(job,))
+
+def _job_status(slot, result_slot):
+    """Progress while the job in `slot` runs; once done its result moves to
+    `result_slot`, otherwise why it stopped is shown."""
+    pending = st.session_state.get(slot)
+    job     = pending["job"]
+    if job.state == DONE:
+        del st.session_state[slot]
+        st.session_state[result_slot] = {
+            **{k: v for k, v in pending.items() if k != "job"}, "result": job.result}
+    elif not job.finished:
+        _job_progress(slot)
+    elif job.state == FAILED:
+        st.markdown(f'<div class="alert alert-warn">⚠️ Cleaning failed: {job.error}</div>',
+                    unsafe_allow_html=True)
+    else:
+        st.markdown('<div class="alert alert-warn">Cleaning cancelled.</div>',
+                    unsafe_allow_html=True)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  RESULT RENDERING
+# ═══════════════════════════════════════════════════════════════════════════════
+def _stat_grid(stats, approx=False):
+    """Original / Addresses / Removed boxes for one set of stats (≈ for estimates)."""
+    mark = "≈ " if approx else ""
+    st.markdown(f"""
+    <div class="stat-grid">
+        <div class="stat-box">
+            <div class="stat-val">{mark}{stats["original_count"]:,}</div>
+            <div class="stat-lbl">Original Rows</div>
+        </div>
+        <div class="stat-box">
+            <div class="stat-val">{mark}{stats["final_count"]:,}</div>
+            <div class="stat-lbl">Addresses</div>
+        </div>
+        <div class="stat-box">
+            <div class="stat-val">{mark}{stats["removed_count"]:,}</div>
+            <div class="stat-lbl">Removed</div>
+        </div>
+    </div>
+    """, unsafe_allow_html=True)
+
+PREVIEW_PAGE_ROWS = 50
+
+def _preview_section(preview):
+    """Estimated whole-file stats and a paged table of the sample's cleaned rows."""
+    cleaned, estimate, fraction = preview["cleaned"], preview["estimate"], preview["fraction"]
+    st.markdown('<div class="section-label">Preview</div>', unsafe_allow_html=True)
+    _stat_grid(estimate, approx=fraction < 1)
+    sampled = (f"Estimated from the first {fraction:.0%} of the file"
+               if fraction < 1 else "The whole file fitted in the sample")
+    st.markdown(
+        f'<div class="alert alert-success">{sampled}  ·  '
+        f'{"≈ " if fraction < 1 else ""}{estimate["uprn_matched"]:,} UPRN numbers</div>',
+        unsafe_allow_html=True,
+    )
+    pages = max(1, -(-len(cleaned) // PREVIEW_PAGE_ROWS))
+    page  = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1,
+                            key="_preview_page") if pages > 1 else 1
+    start = (page - 1) * PREVIEW_PAGE_ROWS
+    st.dataframe(cleaned.iloc[start:start + PREVIEW_PAGE_ROWS], hide_index=True, width="stretch")
+
+def _cached_download(cache, key, build):
+    """build()'s bytes, kept in `cache` under `key` after the first call."""
+    payload = cache.get(key)
+    if payload is None:
+        payload = build()
+        cache.put(key, payload)
+    return payload
+
+@st.cache_resource
+def _perf_lock():
+    """Guards the cached results' stage lists, which download callbacks extend
+    from Streamlit's media threads while other sessions read them."""
+    return threading.Lock()
+
+def _timed_build(build, fmt, rows, perf_stages, **context):
+    """build() timed as the run's to_<fmt> stage: appended to `perf_stages`
+    (shown in the Performance expander) and logged as a run line of its own."""
+    profiler = StageProfiler()
+    with profiler.stage(f"to_{fmt}", rows_in=rows) as stage:
+        payload = build()
+        stage["rows_out"] = rows
+    with _perf_lock():
+        perf_stages.extend(profiler.stages)
+    log_run(profiler, {}, **context)
+    return payload
+
+def _download_button(label, data, file_name, mime, key=None):
+    """Download button whose file is built only when it is clicked.
+
+    `data` is bytes, or a zero-argument callable returning bytes that
+    Streamlit runs on click; with a `key` those bytes are kept in the result
+    cache so later clicks don't serialize again.
+    """
+    if callable(data) and key is not None:
+        data = functools.partial(_cached_download, _result_cache(), key, data)
+    st.download_button(label=label, data=data, file_name=file_name, mime=mime, on_click="ignore")
+
+def _performance_expander(perf_stages):
+    with _perf_lock():
+        perf_stages = list(perf_stages)
+    with st.expander("⏱  Performance"):
+        st.dataframe(
+            pd.DataFrame(perf_stages).rename(columns={
+                "stage": "Stage", "seconds": "Seconds", "rows_in": "Rows in",
+                "rows_out": "Rows out", "mem_delta_mb": "Memory Δ (MB)", "file": "File",
+            }),
+            hide_index=True,
+            width="stretch",
+        )
+        total = sum(s["seconds"] for s in perf_stages)
+        st.caption(f"{total:.2f}s across {len(perf_stages)} stages")
+
+def _merges_expander(merges):
+    """Table of the near-duplicate addresses fuzzy dedup merged away."""
+    with st.expander(f"🔗  Merged near-duplicates ({len(merges):,})"):
+        st.dataframe(merges, hide_index=True, width="stretch")
+
 # ═══════════════════════════════════════════════════════════════════════════════
 #  LOGO
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -31,76 +382,76 @@ LOGO_URL = (
 # ═══════════════════════════════════════════════════════════════════════════════
 #  THEME CSS
 # ═══════════════════════════════════════════════════════════════════════════════
-dark = st.session_state.dark_mode
-
-if dark:
-    BG_MAIN       = "#060d18"
-    BG_CARD       = "rgba(255,255,255,0.04)"
-    BG_CARD_HOVER = "rgba(255,255,255,0.06)"
-    BORDER        = "rgba(255,255,255,0.09)"
-    BORDER_ACCENT = "rgba(0,195,160,0.35)"
-    TXT_PRIMARY   = "rgba(255,255,255,0.88)"
-    TXT_MUTED     = "rgba(255,255,255,0.38)"
-    TAG_BG        = "rgba(13,217,179,0.10)"
-    TAG_BORDER    = "rgba(13,217,179,0.28)"
-    TAG_TXT       = "rgba(13,217,179,0.90)"
-    TAG_BG_B      = "rgba(59,130,246,0.10)"
-    TAG_BORDER_B  = "rgba(59,130,246,0.28)"
-    TAG_TXT_B     = "rgba(99,168,255,0.90)"
-    TAG_BG_P      = "rgba(168,85,247,0.10)"
-    TAG_BORDER_P  = "rgba(168,85,247,0.28)"
-    TAG_TXT_P     = "rgba(196,140,255,0.90)"
-    ALERT_BG      = "rgba(13,217,179,0.07)"
-    ALERT_BORDER  = "rgba(13,217,179,0.28)"
-    ALERT_TXT     = "rgba(13,217,179,0.92)"
-    WARN_BG       = "rgba(251,191,36,0.08)"
-    WARN_BORDER   = "rgba(251,191,36,0.28)"
-    WARN_TXT      = "rgba(251,191,36,0.92)"
-    STAT_BG       = "rgba(255,255,255,0.04)"
-    STAT_BORDER   = "rgba(255,255,255,0.07)"
-    ORB1          = "rgba(0,195,160,0.17)"
-    ORB2          = "rgba(59,130,246,0.13)"
-    UPLOAD_HOVER  = "rgba(0,195,160,0.04)"
-    BTN_DL_BG     = "rgba(255,255,255,0.06)"
-    BTN_DL_HOVER  = "rgba(0,195,160,0.10)"
-    INPUT_TXT     = "rgba(255,255,255,0.50)"
-    LOGO_FILTER   = "drop-shadow(0 0 18px rgba(0,195,160,0.35))"
-    DIVIDER_COLOR = "rgba(0,195,160,0.35), rgba(59,130,246,0.35)"
-else:
-    BG_MAIN       = "#eef2f7"
-    BG_CARD       = "rgba(255,255,255,0.80)"
-    BG_CARD_HOVER = "rgba(255,255,255,0.95)"
-    BORDER        = "rgba(0,0,0,0.08)"
-    BORDER_ACCENT = "rgba(0,150,120,0.40)"
-    TXT_PRIMARY   = "#162030"
-    TXT_MUTED     = "#7a8fa8"
-    TAG_BG        = "rgba(0,160,130,0.09)"
-    TAG_BORDER    = "rgba(0,160,130,0.30)"
-    TAG_TXT       = "#007a65"
-    TAG_BG_B      = "rgba(37,99,235,0.08)"
-    TAG_BORDER_B  = "rgba(37,99,235,0.28)"
-    TAG_TXT_B     = "#1d4ed8"
-    TAG_BG_P      = "rgba(126,34,206,0.08)"
-    TAG_BORDER_P  = "rgba(126,34,206,0.28)"
-    TAG_TXT_P     = "#6b21a8"
-    ALERT_BG      = "rgba(0,160,130,0.08)"
-    ALERT_BORDER  = "rgba(0,160,130,0.30)"
-    ALERT_TXT     = "#065f46"
-    WARN_BG       = "rgba(180,130,0,0.08)"
-    WARN_BORDER   = "rgba(180,130,0,0.30)"
-    WARN_TXT      = "#78450a"
-    STAT_BG       = "rgba(255,255,255,0.70)"
-    STAT_BORDER   = "rgba(0,0,0,0.07)"
-    ORB1          = "rgba(0,195,160,0.12)"
-    ORB2          = "rgba(59,130,246,0.10)"
-    UPLOAD_HOVER  = "rgba(0,160,130,0.04)"
-    BTN_DL_BG     = "rgba(0,0,0,0.04)"
-    BTN_DL_HOVER  = "rgba(0,160,130,0.08)"
-    INPUT_TXT     = "#7a8fa8"
-    LOGO_FILTER   = "drop-shadow(0 4px 12px rgba(0,0,0,0.15))"
-    DIVIDER_COLOR = "rgba(0,160,130,0.35), rgba(37,99,235,0.35)"
-
-st.markdown(f"""
+def _theme_css(dark):
+    """The app's <style> block for the dark or light palette."""
+    if dark:
+        BG_MAIN       = "#060d18"
+        BG_CARD       = "rgba(255,255,255,0.04)"
+        BG_CARD_HOVER = "rgba(255,255,255,0.06)"
+        BORDER        = "rgba(255,255,255,0.09)"
+        BORDER_ACCENT = "rgba(0,195,160,0.35)"
+        TXT_PRIMARY   = "rgba(255,255,255,0.88)"
+        TXT_MUTED     = "rgba(255,255,255,0.38)"
+        TAG_BG        = "rgba(13,217,179,0.10)"
+        TAG_BORDER    = "rgba(13,217,179,0.28)"
+        TAG_TXT       = "rgba(13,217,179,0.90)"
+        TAG_BG_B      = "rgba(59,130,246,0.10)"
+        TAG_BORDER_B  = "rgba(59,130,246,0.28)"
+        TAG_TXT_B     = "rgba(99,168,255,0.90)"
+        TAG_BG_P      = "rgba(168,85,247,0.10)"
+        TAG_BORDER_P  = "rgba(168,85,247,0.28)"
+        TAG_TXT_P     = "rgba(196,140,255,0.90)"
+        ALERT_BG      = "rgba(13,217,179,0.07)"
+        ALERT_BORDER  = "rgba(13,217,179,0.28)"
+        ALERT_TXT     = "rgba(13,217,179,0.92)"
+        WARN_BG       = "rgba(251,191,36,0.08)"
+        WARN_BORDER   = "rgba(251,191,36,0.28)"
+        WARN_TXT      = "rgba(251,191,36,0.92)"
+        STAT_BG       = "rgba(255,255,255,0.04)"
+        STAT_BORDER   = "rgba(255,255,255,0.07)"
+        ORB1          = "rgba(0,195,160,0.17)"
+        ORB2          = "rgba(59,130,246,0.13)"
+        UPLOAD_HOVER  = "rgba(0,195,160,0.04)"
+        BTN_DL_BG     = "rgba(255,255,255,0.06)"
+        BTN_DL_HOVER  = "rgba(0,195,160,0.10)"
+        INPUT_TXT     = "rgba(255,255,255,0.50)"
+        LOGO_FILTER   = "drop-shadow(0 0 18px rgba(0,195,160,0.35))"
+        DIVIDER_COLOR = "rgba(0,195,160,0.35), rgba(59,130,246,0.35)"
+    else:
+        BG_MAIN       = "#eef2f7"
+        BG_CARD       = "rgba(255,255,255,0.80)"
+        BG_CARD_HOVER = "rgba(255,255,255,0.95)"
+        BORDER        = "rgba(0,0,0,0.08)"
+        BORDER_ACCENT = "rgba(0,150,120,0.40)"
+        TXT_PRIMARY   = "#162030"
+        TXT_MUTED     = "#7a8fa8"
+        TAG_BG        = "rgba(0,160,130,0.09)"
+        TAG_BORDER    = "rgba(0,160,130,0.30)"
+        TAG_TXT       = "#007a65"
+        TAG_BG_B      = "rgba(37,99,235,0.08)"
+        TAG_BORDER_B  = "rgba(37,99,235,0.28)"
+        TAG_TXT_B     = "#1d4ed8"
+        TAG_BG_P      = "rgba(126,34,206,0.08)"
+        TAG_BORDER_P  = "rgba(126,34,206,0.28)"
+        TAG_TXT_P     = "#6b21a8"
+        ALERT_BG      = "rgba(0,160,130,0.08)"
+        ALERT_BORDER  = "rgba(0,160,130,0.30)"
+        ALERT_TXT     = "#065f46"
+        WARN_BG       = "rgba(180,130,0,0.08)"
+        WARN_BORDER   = "rgba(180,130,0,0.30)"
+        WARN_TXT      = "#78450a"
+        STAT_BG       = "rgba(255,255,255,0.70)"
+        STAT_BORDER   = "rgba(0,0,0,0.07)"
+        ORB1          = "rgba(0,195,160,0.12)"
+        ORB2          = "rgba(59,130,246,0.10)"
+        UPLOAD_HOVER  = "rgba(0,160,130,0.04)"
+        BTN_DL_BG     = "rgba(0,0,0,0.04)"
+        BTN_DL_HOVER  = "rgba(0,160,130,0.08)"
+        INPUT_TXT     = "#7a8fa8"
+        LOGO_FILTER   = "drop-shadow(0 4px 12px rgba(0,0,0,0.15))"
+        DIVIDER_COLOR = "rgba(0,160,130,0.35), rgba(37,99,235,0.35)"
+
+    return f"""
 <style>
 @import url('https://fonts.googleapis.com/css2?family=DM+Sans:wght@300;400;500;600;700&family=DM+Mono:wght@400;500&display=swap');
 
@@ -332,110 +683,299 @@ header {{ visibility: hidden; }}
     border-color: rgba(0,195,160,0.65) !important;
 }}
 </style>
-""", unsafe_allow_html=True)
+"""
 
-# ═══════════════════════════════════════════════════════════════════════════════
-#  CONSTANTS
-# ═══════════════════════════════════════════════════════════════════════════════
-UK_POSTCODE = re.compile(r'\b([A-Z]{1,2}\d[A-Z\d]?\s*\d[A-Z]{2})\b', re.IGNORECASE)
-
-KNOWN_CUSTOM_FIELDS = [
-    "Wave 3 Year 2 Saffron Fields",
-    "Watford Low Rise",
-    "Dodds Group",
-    "Watford Community Housing",
-    "GreenHouse Energy Stages",
-    "Wave 3 Saffron Stages",
-    "Cold Rush Stages",
-    "Align Property Stages",
-    "North Yorkshire Council Stages",
-]
+@st.cache_resource
+def _theme_stylesheets():
+    """Both themes' stylesheets, built once per server process rather than every rerun."""
+    return {dark: _theme_css(dark) for dark in (True, False)}
 
-# ═══════════════════════════════════════════════════════════════════════════════
-#  HELPERS
-# ═══════════════════════════════════════════════════════════════════════════════
-def is_address(value):
-    if pd.isna(value) or str(value).strip() == "":
-        return False
-    return bool(UK_POSTCODE.search(str(value)))
-
-def extract_postcode(value):
-    if pd.isna(value):
-        return ""
-    match = UK_POSTCODE.search(str(value))
-    if not match:
-        return ""
-    raw = match.group(1).upper().replace(" ", "")
-    return raw[:-3] + " " + raw[-3:]
-
-def extract_uprn_value(notes_value):
-    if pd.isna(notes_value):
-        return ""
-    match = re.search(r'UPRN:\s*(\d+)', str(notes_value))
-    return match.group(1) if match else ""
-
-def auto_detect_columns(columns):
-    cols_lower = {c.lower().strip(): c for c in columns}
-    return (
-        cols_lower.get('parent task'),
-        cols_lower.get('name'),
-        cols_lower.get('notes'),
-    )
-
-def detect_custom_fields(columns):
-    col_set = {c.strip() for c in columns}
-    return [cf for cf in KNOWN_CUSTOM_FIELDS if cf in col_set]
-
-def build_uprn_map(df, name_col, notes_col):
-    uprn_map = {}
-    if not name_col or not notes_col:
-        return uprn_map
-    if notes_col not in df.columns or name_col not in df.columns:
-        return uprn_map
-    for _, row in df.iterrows():
-        name  = str(row[name_col]).strip()       if pd.notna(row[name_col])      else ""
-        notes = row[notes_col]                   if pd.notna(row.get(notes_col)) else None
-        if name and notes:
-            uprn = extract_uprn_value(notes)
-            if uprn:
-                uprn_map[name] = uprn
-    return uprn_map
+st.markdown(_theme_stylesheets()[st.session_state.dark_mode], unsafe_allow_html=True)
 
 # ═══════════════════════════════════════════════════════════════════════════════
 #  HEADER — logo + subtitle + theme toggle
 # ═══════════════════════════════════════════════════════════════════════════════
-logo_col, toggle_col = st.columns([5, 2])
+@st.fragment
+def _header():
+    logo_col, toggle_col = st.columns([5, 2])
 
-with logo_col:
-    st.markdown(
-        f'<div class="cph-logo">'
-        f'<img src="{LOGO_URL}" alt="CPH Retrofit"></div>'
-        f'<div class="cph-subtitle">Asana CSV Cleaner</div>',
-        unsafe_allow_html=True,
-    )
+    with logo_col:
+        st.markdown(
+            f'<div class="cph-logo">'
+            f'<img src="{LOGO_URL}" alt="CPH Retrofit"></div>'
+            f'<div class="cph-subtitle">Asana CSV Cleaner</div>',
+            unsafe_allow_html=True,
+        )
 
-with toggle_col:
-    st.markdown("<div style='padding-top:1.6rem'></div>", unsafe_allow_html=True)
-    st.toggle(
-        "🌓  Dark mode",
-        value=st.session_state.dark_mode,
-        key="_theme_toggle",
-        on_change=_toggle_theme,
-    )
+    with toggle_col:
+        st.markdown("<div style='padding-top:1.6rem'></div>", unsafe_allow_html=True)
+        dark_mode = st.toggle("🌓  Dark mode", value=st.session_state.dark_mode, key="_theme_toggle")
+
+    # The stylesheet sits outside this fragment, so a theme change reruns the app
+    if dark_mode != st.session_state.dark_mode:
+        st.session_state.dark_mode = dark_mode
+        st.rerun()
+
+_header()
 
 # ═══════════════════════════════════════════════════════════════════════════════
 #  UPLOAD
 # ═══════════════════════════════════════════════════════════════════════════════
 st.markdown('<div class="section-label">Upload Asana export</div>', unsafe_allow_html=True)
-uploaded_file = st.file_uploader("", type=["csv"])
+uploaded_files = st.file_uploader("", type=["csv", "xlsx"], accept_multiple_files=True)
+uploaded_file  = uploaded_files[0] if len(uploaded_files or []) == 1 else None
 
 # ═══════════════════════════════════════════════════════════════════════════════
 #  MAIN LOGIC
 # ═══════════════════════════════════════════════════════════════════════════════
+# Options, results and downloads are separate fragments: a widget reruns only
+# its own section, and the last result lives in session_state, so nothing is
+# re-parsed or re-cleaned until Clean is pressed again.
+
+def _stream_clean(source, options, fmt, profiler=None):
+    """clean_csv_streaming of an upload into a temp file; returns (bytes, stats)."""
+    with tempfile.TemporaryFile() as output:
+        stats = clean_csv_streaming(source, output, options, profiler=profiler, fmt=fmt)
+        output.seek(0)
+        return output.read(), stats
+
+def _single_clean_job(data, name, digest, options, fmt, streaming, incremental, project,
+                      result_key):
+    """run(job) cleaning the upload `data` for the job queue; the result is
+    (cleaned, stats, stage records, changes) and is cached under `result_key`."""
+    cache = _result_cache()
+
+    def run(job):
+        source   = io.BytesIO(data)
+        profiler = JobProfiler(job, source if streaming else None, len(data))
+        changes  = None
+        if streaming:
+            cleaned, stats = _stream_clean(source, options, fmt, profiler)
+        else:
+            df = cache.get(("frame", digest))
+            if df is None:
+                with profiler.stage("read_csv") as stage:
+                    df = read_export(source)
+                    stage["rows_out"] = len(df)
+                cache.put(("frame", digest), df)
+            if incremental:
+                with AddressIndex() as index:
+                    cleaned, changes, stats = clean_incremental(
+                        df, index, project, options, profiler)
+            else:
+                cleaned, stats = clean_asana_export(df, options, profiler)
+
+        log_run(
+            profiler, stats,
+            file=name, bytes=len(data),
+            digest=digest[:12], streaming=streaming,
+        )
+        result = (cleaned, stats, profiler.stages, changes)
+        cache.put(result_key, result)
+        return result
+
+    return run
+
+@st.fragment
+def _single_options(uploaded_file, digest):
+    """Options and the Clean button; queues the run as session_state._single_job,
+    or stores an already-cached result straight in _single_result."""
+    cache = _result_cache()
+
+    # ── Options ───────────────────────────────────────────────────────────
+    st.markdown('<hr class="grad-divider">', unsafe_allow_html=True)
+    st.markdown('<div class="section-label">Options</div>', unsafe_allow_html=True)
+    extract_uprn = st.checkbox(
+        "Extract UPRN Number from Notes",
+        value=True,
+        help="Reads UPRN numbers from parent task Notes and adds a dedicated column.",
+    )
+    streaming = st.checkbox(
+        "Low-memory streaming mode",
+        value=export_size(uploaded_file) > STREAM_THRESHOLD_MB * 1024 * 1024,
+        help="Cleans the export in chunks and writes rows as it goes, "
+             "so very large files never have to fit in memory at once.",
+    )
+    incremental = st.checkbox(
+        "Incremental mode (only re-process new or changed rows)",
+        value=False,
+        help="Remembers earlier runs of the same project so unchanged rows skip "
+             "postcode and UPRN extraction, and adds a “changes since last run” "
+             "download. Loads the whole file, so it overrides streaming mode.",
+    )
+    fuzzy_dedup    = _fuzzy_dedup_checkbox()
+    reference_data = _reference_data_options(extract_uprn)
+    project = None
+    if incremental:
+        project   = st.text_input("Project name", value=os.path.splitext(uploaded_file.name)[0])
+        streaming = False
+    preview_first = st.checkbox(
+        "Preview a sample first",
+        value=uploaded_file.size > PREVIEW_MB * 1024 * 1024,
+        help=f"Cleans only the first {PREVIEW_MB} MB to check the detected columns and "
+             f"options, with estimated counts for the whole file, before the full clean.",
+    )
+    options = CleanOptions(extract_uprn=extract_uprn, fuzzy_dedup=fuzzy_dedup, **reference_data)
+
+    st.markdown('<hr class="grad-divider">', unsafe_allow_html=True)
+
+    # A preview is a plain clean of the sample: no streaming output and no
+    # incremental index writes, so it can be thrown away
+    if preview_first:
+        if st.button("👁  Preview sample"):
+            preview = cache.get(("preview", digest, options))
+            if preview is None:
+                cleaned, _, estimate, fraction = preview_export(uploaded_file, options)
+                preview = {"cleaned": cleaned, "estimate": estimate, "fraction": fraction}
+                cache.put(("preview", digest, options), preview)
+            st.session_state._single_preview = {**preview, "digest": digest, "options": options}
+        preview = st.session_state.get("_single_preview")
+        if not preview or preview["digest"] != digest or preview["options"] != options:
+            return
+        _preview_section(preview)
+        if not st.button("✦  Clean full file"):
+            return
+    elif not st.button("✦  Clean CSV"):
+        return
+
+    # Streaming writes the output file while cleaning, in the format last
+    # picked for download; otherwise the cleaned frame is kept and serialized
+    # when downloaded
+    fmt     = st.session_state.get("_single_fmt", "csv")
+    if incremental:   # each run diffs against the index afresh, so gets its own key
+        result_key = ("incremental", digest, options, project, uuid.uuid4().hex)
+    elif streaming:
+        result_key = ("stream", digest, options, fmt)
+    else:
+        result_key = ("clean", digest, options)
+
+    shown = {
+        "digest":  digest,
+        "key":     result_key,
+        "options": options,
+        "fmt":     fmt if streaming else None,
+        "project": project,
+    }
+
+    # An incremental run diffs against the index, so every click is a new run
+    result = None if incremental else cache.get(result_key)
+    if result is not None:
+        st.session_state._single_result = {**shown, "result": result}
+        st.rerun()   # repaint the results and download sections
+
+    # The job gets its own copy of the bytes: the upload widget's buffer is
+    # read by this session's reruns while the job runs
+    data = uploaded_file.getvalue()
+    run  = _single_clean_job(data, uploaded_file.name, digest, options, fmt, streaming,
+                             incremental, project, result_key)
+    if _submit_job("_single_job", run, job_memory(data, streaming),
+                   {**shown, "streaming": streaming}):
+        st.rerun()   # show the job's progress
+
+@st.fragment
+def _single_results(shown, notes_col, found_custom_fields):
+    cleaned, stats, perf_stages, changes = shown["result"]
+    final_count    = stats["final_count"]
+    dupes_removed  = stats["dupes_removed"]
+    uprn_matched   = stats["uprn_matched"]
+
+    # ── Results ───────────────────────────────────────────────────────────
+    _stat_grid(stats)
+    _performance_expander(perf_stages)
+
+    parts = [f"✦ {final_count:,} unique addresses"]
+    if dupes_removed > 0:
+        parts.append(f"{dupes_removed:,} duplicates removed")
+    if stats.get("fuzzy_dupes_removed"):
+        parts.append(f"{stats['fuzzy_dupes_removed']:,} near-duplicates merged")
+    if shown["options"].extract_uprn and notes_col:
+        parts.append(f"{uprn_matched:,} UPRN numbers extracted")
+    parts += _reference_data_parts(stats)
+    if found_custom_fields:
+        parts.append(f"{len(found_custom_fields)} custom field(s) included")
+
+    st.markdown(
+        f'<div class="alert alert-success">{"  ·  ".join(parts)}</div>',
+        unsafe_allow_html=True,
+    )
+
+    if changes is not None:
+        st.markdown(
+            f'<div class="alert alert-success">Since the last run of “{shown["project"]}”: '
+            f'{stats["added"]:,} added  ·  {stats["changed"]:,} changed  ·  '
+            f'{stats["removed"]:,} removed</div>',
+            unsafe_allow_html=True,
+        )
+    if "fuzzy_merges" in stats:
+        _merges_expander(stats["fuzzy_merges"])
+
+def _restream_button(uploaded_file, shown, fmt):
+    """Offer to stream-clean the upload again in `fmt` as a queued job."""
+    label = OUTPUT_FORMATS[fmt][0]
+    st.markdown(
+        f'<div class="alert alert-success">This result was streamed straight to '
+        f'{OUTPUT_FORMATS[shown["fmt"]][0]}; a {label} file needs another streaming pass.</div>',
+        unsafe_allow_html=True,
+    )
+    if not st.button(f"✦  Clean again as {label}"):
+        return
+    data       = uploaded_file.getvalue()
+    result_key = ("stream", shown["digest"], shown["options"], fmt)
+    run        = _single_clean_job(data, uploaded_file.name, shown["digest"], shown["options"],
+                                   fmt, True, False, None, result_key)
+    restream   = {"digest": shown["digest"], "key": result_key, "options": shown["options"],
+                  "fmt": fmt, "project": None, "streaming": True}
+    if _submit_job("_single_job", run, job_memory(data, streaming=True), restream):
+        st.rerun()   # show the job's progress
+
+@st.fragment
+def _single_downloads(uploaded_file, shown):
+    cleaned, _, perf_stages, changes = shown["result"]
+    fmt = _format_picker(key="_single_fmt")
+    label, _, mime = OUTPUT_FORMATS[fmt]
+
+    # A streamed result is already a file; another format means streaming the
+    # upload again, which is queued like any other clean
+    if shown["fmt"] == fmt:
+        data = cleaned
+    elif shown["fmt"]:
+        restreamed = _result_cache().get(("stream", shown["digest"], shown["options"], fmt))
+        if restreamed is None:
+            _restream_button(uploaded_file, shown, fmt)
+            return
+        data = restreamed[0]
+    else:
+        data = functools.partial(
+            _timed_build, lambda: output_bytes(cleaned, fmt), fmt, len(cleaned), perf_stages,
+            file=uploaded_file.name, digest=shown["digest"][:12], download="cleaned")
+
+    _download_button(
+        f"⬇  Download Cleaned {label}",
+        data,
+        output_file_name(uploaded_file.name, fmt),
+        mime,
+        key=("download", shown["key"], fmt),
+    )
+    if changes is not None:
+        _download_button(
+            "⬇  Download Changes Since Last Run",
+            functools.partial(
+                _timed_build, lambda: output_bytes(changes, fmt), fmt, len(changes), perf_stages,
+                file=uploaded_file.name, digest=shown["digest"][:12], download="changes"),
+            output_file_name(uploaded_file.name, fmt, prefix="changes_"),
+            mime,
+            key=("download", shown["key"], "changes", fmt),
+        )
+
 if uploaded_file:
-    df             = pd.read_csv(uploaded_file, dtype=str)
-    columns        = list(df.columns)
-    original_count = len(df)
+    cache  = _result_cache()
+    digest = _upload_digest(uploaded_file)
+
+    columns = cache.get(("columns", digest))
+    if columns is None:
+        # Header only — the full parse waits until Clean is pressed
+        columns = read_header(uploaded_file)
+        cache.put(("columns", digest), columns)
 
     parent_col, name_col, notes_col = auto_detect_columns(columns)
     found_custom_fields              = detect_custom_fields(columns)
@@ -462,102 +1002,196 @@ if uploaded_file:
     if not parent_col:
         st.markdown(
             '<div class="alert alert-warn">⚠️ No "Parent task" column found. '
-            'Please check this is a standard Asana CSV export.</div>',
+            'Please check this is a standard Asana CSV or Excel export.</div>',
             unsafe_allow_html=True,
         )
     else:
-        # ── Options ───────────────────────────────────────────────────────
-        st.markdown('<hr class="grad-divider">', unsafe_allow_html=True)
-        st.markdown('<div class="section-label">Options</div>', unsafe_allow_html=True)
-        extract_uprn = st.checkbox(
-            "Extract UPRN Number from Notes",
-            value=True,
-            help="Reads UPRN numbers from parent task Notes and adds a dedicated column.",
+        _single_options(uploaded_file, digest)
+        pending = st.session_state.get("_single_job")
+        if pending and pending["digest"] == digest:
+            _job_status("_single_job", "_single_result")
+        shown = st.session_state.get("_single_result")
+        if shown and shown["digest"] == digest:
+            _single_results(shown, notes_col, found_custom_fields)
+            _single_downloads(uploaded_file, shown)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  MULTI-FILE
+# ═══════════════════════════════════════════════════════════════════════════════
+MERGED_FILE  = "One merged file"
+ZIP_OF_FILES = "ZIP of per-file files"
+
+@st.fragment
+def _multi_options(uploads):
+    """Options and the Clean button; queues the run as session_state._multi_job,
+    or stores an already-cached result straight in _multi_result."""
+    cache = _result_cache()
+
+    # ── Options ───────────────────────────────────────────────────────────
+    st.markdown('<hr class="grad-divider">', unsafe_allow_html=True)
+    st.markdown('<div class="section-label">Options</div>', unsafe_allow_html=True)
+    extract_uprn = st.checkbox(
+        "Extract UPRN Number from Notes",
+        value=True,
+        help="Reads UPRN numbers from parent task Notes and adds a dedicated column.",
+    )
+    dedupe_across = st.checkbox(
+        "Deduplicate addresses across files",
+        value=False,
+        help="Keeps each address only in the first file (in upload order) that contains it.",
+    )
+    fuzzy_dedup    = _fuzzy_dedup_checkbox()
+    reference_data = _reference_data_options(extract_uprn)
+
+    st.markdown('<hr class="grad-divider">', unsafe_allow_html=True)
+
+    if not st.button(f"✦  Clean {len(uploads)} exports"):
+        return
+
+    options    = CleanOptions(extract_uprn=extract_uprn, fuzzy_dedup=fuzzy_dedup,
+                              **reference_data)
+    digests    = tuple(d for _, d in uploads)
+    result_key = ("multi", digests, options, dedupe_across)
+    shown      = {"digests": digests, "key": result_key, "options": options}
+    result     = cache.get(result_key)
+    if result is not None:
+        st.session_state._multi_result = {**shown, "result": result}
+        st.rerun()   # repaint the results and download sections
+
+    files = [(upload.name, digest, upload.getvalue()) for upload, digest in uploads]
+
+    def run(job):
+        frames, per_file, perf_stages = _clean_uploads(files, options, cache, job)
+
+        cross_removed = [0] * len(frames)
+        if dedupe_across:
+            frames, cross_removed = dedupe_across_files(frames)
+        per_file = [
+            {**stats,
+             "final_count":   len(frame),
+             "removed_count": stats["original_count"] - len(frame),
+             **uprn_counts(frame),
+             **(postcode_check_stats(frame[postcode_index.STATUS_COLUMN])
+                if postcode_index.STATUS_COLUMN in frame.columns else {})}
+            for stats, frame in zip(per_file, frames)
+        ]
+
+        named  = [(name, frame) for (name, _, _), frame in zip(files, frames)]
+        result = (named, per_file, sum(cross_removed), perf_stages)
+        cache.put(result_key, result)
+        return result
+
+    memory = sum(job_memory(data) for _, _, data in files)
+    if _submit_job("_multi_job", run, memory, {**shown, "files": len(files)}):
+        st.rerun()   # show the job's progress
+
+@st.fragment
+def _multi_results(shown, custom_fields):
+    named, per_file, cross_dupes, perf_stages = shown["result"]
+    combined = combine_stats(per_file)
+
+    # ── Results ───────────────────────────────────────────────────────────
+    _stat_grid(combined)
+    _performance_expander(perf_stages)
+
+    parts = [f"✦ {combined['final_count']:,} unique addresses from {len(per_file)} files"]
+    if combined["dupes_removed"] > 0:
+        parts.append(f"{combined['dupes_removed']:,} duplicates removed")
+    if combined.get("fuzzy_dupes_removed"):
+        parts.append(f"{combined['fuzzy_dupes_removed']:,} near-duplicates merged")
+    if cross_dupes > 0:
+        parts.append(f"{cross_dupes:,} cross-file duplicates removed")
+    if shown["options"].extract_uprn:
+        parts.append(f"{combined['uprn_matched']:,} UPRN numbers extracted")
+    parts += _reference_data_parts(combined)
+    if custom_fields:
+        parts.append(f"{len(custom_fields)} custom field(s) included")
+
+    st.markdown(
+        f'<div class="alert alert-success">{"  ·  ".join(parts)}</div>',
+        unsafe_allow_html=True,
+    )
+
+    if shown["options"].fuzzy_dedup:
+        _merges_expander(merge_cleaned(
+            [(name, stats["fuzzy_merges"]) for (name, _), stats in zip(named, per_file)]))
+
+    for (name, _), stats in zip(named, per_file):
+        st.markdown(f'<div class="section-label">📄 {name}</div>', unsafe_allow_html=True)
+        _stat_grid(stats)
+
+@st.fragment
+def _multi_downloads(shown):
+    named       = shown["result"][0]
+    perf_stages = shown["result"][3]
+    rows        = sum(len(frame) for _, frame in named)
+    files       = [name for name, _ in named]
+    packaging = st.radio("Download as", [MERGED_FILE, ZIP_OF_FILES], horizontal=True)
+    fmt       = _format_picker(key="_multi_fmt")
+
+    if packaging == MERGED_FILE:
+        _download_button(
+            f"⬇  Download Cleaned {OUTPUT_FORMATS[fmt][0]}",
+            functools.partial(
+                _timed_build, lambda: output_bytes(merge_cleaned(named), fmt), fmt, rows,
+                perf_stages, files=files, download="merged"),
+            output_file_name("merged", fmt),
+            OUTPUT_FORMATS[fmt][2],
+            key=("download", shown["key"], packaging, fmt),
+        )
+    else:
+        _download_button(
+            "⬇  Download Cleaned ZIP",
+            functools.partial(
+                _timed_build, lambda: zip_cleaned(named, fmt), fmt, rows, perf_stages,
+                files=files, download="zip"),
+            "cleaned_exports.zip",
+            "application/zip",
+            key=("download", shown["key"], packaging, fmt),
+        )
+
+if uploaded_files and len(uploaded_files) > 1:
+    cache = _result_cache()
+
+    uploads, skipped, custom_fields = [], [], []
+    for upload in uploaded_files:
+        digest  = _upload_digest(upload)
+        columns = cache.get(("columns", digest))
+        if columns is None:
+            columns = read_header(upload)
+            cache.put(("columns", digest), columns)
+        if auto_detect_columns(columns)[0]:
+            uploads.append((upload, digest))
+            custom_fields += [cf for cf in detect_custom_fields(columns) if cf not in custom_fields]
+        else:
+            skipped.append(upload.name)
+
+    # ── Detected files ────────────────────────────────────────────────────
+    st.markdown('<hr class="grad-divider">', unsafe_allow_html=True)
+    st.markdown('<div class="section-label">Detected Files</div>', unsafe_allow_html=True)
+    file_tags = "".join(f'<span class="tag">📄 {upload.name}</span>' for upload, _ in uploads)
+    if file_tags:
+        st.markdown(f'<div class="tag-row">{file_tags}</div>', unsafe_allow_html=True)
+
+    if custom_fields:
+        st.markdown('<div style="margin-top:1rem;" class="section-label">Custom Fields Found</div>', unsafe_allow_html=True)
+        cf_tags = "".join(f'<span class="tag purple">🏷 {cf}</span>' for cf in custom_fields)
+        st.markdown(f'<div class="tag-row">{cf_tags}</div>', unsafe_allow_html=True)
+
+    if skipped:
+        st.markdown(
+            f'<div class="alert alert-warn">⚠️ No "Parent task" column in '
+            f'{", ".join(skipped)} — skipped. Please check these are standard '
+            f'Asana CSV or Excel exports.</div>',
+            unsafe_allow_html=True,
         )
 
-        st.markdown('<hr class="grad-divider">', unsafe_allow_html=True)
-
-        if st.button("✦  Clean CSV"):
-          with st.spinner("Cleaning CSV — filtering addresses, extracting postcodes & UPRN numbers…"):
-            # Step 1 — filter to address rows
-            address_mask = df[parent_col].apply(is_address)
-            filtered_df  = df[address_mask].copy()
-
-            # Step 2 — deduplicate
-            before_dedup  = len(filtered_df)
-            filtered_df   = filtered_df.drop_duplicates(subset=parent_col, keep='first')
-            final_count   = len(filtered_df)
-            dupes_removed = before_dedup - final_count
-            removed_count = original_count - final_count
-
-            # Step 3 — postcode column
-            filtered_df['Postcode'] = filtered_df[parent_col].apply(extract_postcode)
-
-            # Step 4 — UPRN extraction
-            uprn_matched = 0
-            if extract_uprn and notes_col and notes_col in df.columns:
-                uprn_map = build_uprn_map(df, name_col, notes_col)
-                filtered_df['UPRN Number'] = filtered_df[parent_col].apply(
-                    lambda x: uprn_map.get(str(x).strip(), '') if pd.notna(x) else ''
-                )
-                uprn_matched = (filtered_df['UPRN Number'] != '').sum()
-
-            # Step 5 — custom fields
-            for cf in found_custom_fields:
-                if cf in df.columns:
-                    filtered_df[cf] = df.loc[filtered_df.index, cf].values
-
-            # Step 6 — rename parent_col → Address
-            filtered_df = filtered_df.rename(columns={parent_col: 'Address'})
-
-            # Step 7 — final column order: Task ID | Address | Postcode | UPRN | custom…
-            keep_cols = ['Task ID', 'Address', 'Postcode']
-            if 'UPRN Number' in filtered_df.columns:
-                keep_cols.append('UPRN Number')
-            for cf in found_custom_fields:
-                if cf in filtered_df.columns:
-                    keep_cols.append(cf)
-            keep_cols   = [c for c in keep_cols if c in filtered_df.columns]
-            filtered_df = filtered_df[keep_cols]
-
-            # ── Results ───────────────────────────────────────────────────
-            buffer = io.StringIO()
-            filtered_df.to_csv(buffer, index=False)
-            buffer.seek(0)
-
-            st.markdown(f"""
-            <div class="stat-grid">
-                <div class="stat-box">
-                    <div class="stat-val">{original_count:,}</div>
-                    <div class="stat-lbl">Original Rows</div>
-                </div>
-                <div class="stat-box">
-                    <div class="stat-val">{final_count:,}</div>
-                    <div class="stat-lbl">Addresses</div>
-                </div>
-                <div class="stat-box">
-                    <div class="stat-val">{removed_count:,}</div>
-                    <div class="stat-lbl">Removed</div>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-
-            parts = [f"✦ {final_count:,} unique addresses"]
-            if dupes_removed > 0:
-                parts.append(f"{dupes_removed:,} duplicates removed")
-            if extract_uprn and notes_col:
-                parts.append(f"{uprn_matched:,} UPRN numbers extracted")
-            if found_custom_fields:
-                parts.append(f"{len(found_custom_fields)} custom field(s) included")
-
-            st.markdown(
-                f'<div class="alert alert-success">{"  ·  ".join(parts)}</div>',
-                unsafe_allow_html=True,
-            )
-
-            st.download_button(
-                label="⬇  Download Cleaned CSV",
-                data=buffer.getvalue(),
-                file_name="cleaned_" + uploaded_file.name,
-                mime="text/csv",
-            )
+    if uploads:
+        _multi_options(uploads)
+        pending = st.session_state.get("_multi_job")
+        if pending and pending["digests"] == tuple(d for _, d in uploads):
+            _job_status("_multi_job", "_multi_result")
+        shown = st.session_state.get("_multi_result")
+        if shown and shown["digests"] == tuple(d for _, d in uploads):
+            _multi_results(shown, custom_fields)
+            _multi_downloads(shown)
@@ -0,0 +1,992 @@
+"""Headless Asana export cleaning — the pipeline behind the Streamlit app.
+
+Nothing in here imports Streamlit, so the same code runs from the app, from
+batch_clean.py, or from any script that has an Asana export:
+
+    df = read_export("export.csv")
+    cleaned, stats = clean_asana_export(df, CleanOptions(extract_uprn=True))
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+import datetime
+import functools
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import time
+import tracemalloc
+import zipfile
+
+import numpy as np
+import openpyxl
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+import pandas as pd
+from pandas._libs.parsers import STR_NA_VALUES
+
+from address_match import (
+    CONFIDENCE_COLUMN,
+    FROM_NOTES,
+    MERGE_COLUMNS,
+    match_uprns,
+    merge_report,
+    near_duplicates,
+)
+from address_match import load_reference as load_uprn_reference
+from postcode_index import DETAIL_COLUMNS, NOT_FOUND, STATUS_COLUMN, TERMINATED
+from postcode_index import load_index as load_postcode_index
+from postcode_index import lookup as lookup_postcodes
+from sharding import apply_sharded
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  CONSTANTS
+# ═══════════════════════════════════════════════════════════════════════════════
+UK_POSTCODE = re.compile(r'\b([A-Z]{1,2}\d[A-Z\d]?\s*\d[A-Z]{2})\b', re.IGNORECASE)
+UPRN_PATTERN = re.compile(r'UPRN:\s*(\d+)')
+
+KNOWN_CUSTOM_FIELDS = [
+    "Wave 3 Year 2 Saffron Fields",
+    "Watford Low Rise",
+    "Dodds Group",
+    "Watford Community Housing",
+    "GreenHouse Energy Stages",
+    "Wave 3 Saffron Stages",
+    "Cold Rush Stages",
+    "Align Property Stages",
+    "North Yorkshire Council Stages",
+]
+
+STREAM_CHUNK_ROWS     = 50_000   # rows per read_csv chunk in streaming mode
+STREAM_THRESHOLD_MB   = 50       # uploads larger than this default to streaming
+PREVIEW_MB            = 5        # leading slice of an upload that a preview cleans
+PREVIEW_CHUNK_ROWS    = 10_000   # read granularity of that slice
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  HELPERS
+# ═══════════════════════════════════════════════════════════════════════════════
+def is_address(value):
+    if pd.isna(value) or str(value).strip() == "":
+        return False
+    return bool(UK_POSTCODE.search(str(value)))
+
+def extract_postcode(value):
+    if pd.isna(value):
+        return ""
+    match = UK_POSTCODE.search(str(value))
+    if not match:
+        return ""
+    raw = match.group(1).upper().replace(" ", "")
+    return raw[:-3] + " " + raw[-3:]
+
+def extract_postcodes(series):
+    """Vectorised is_address + extract_postcode: one regex pass over the column,
+    sharded across cores when the column is large (see sharding.py).
+
+    Returns (address_mask, postcodes) aligned to `series`; rows without a
+    postcode get False / "" exactly as the row-wise helpers would.
+    """
+    return apply_sharded(_postcode_matches, series)
+
+def _postcode_matches(series):
+    raw       = series.str.extract(UK_POSTCODE, expand=False)
+    mask      = raw.notna()
+    compact   = raw.str.upper().str.replace(" ", "", regex=False)
+    postcodes = (compact.str[:-3] + " " + compact.str[-3:]).fillna("")
+    return mask, postcodes
+
+def first_positions(codes):
+    """Row position of each code's first occurrence, in code order.
+
+    pd.factorize numbers values in order of appearance, so a row is a first
+    occurrence exactly when its code exceeds every code before it.
+    """
+    running = np.maximum.accumulate(codes) if len(codes) else codes
+    return np.flatnonzero(np.diff(running, prepend=-1) > 0)
+
+def per_unique(series, transform):
+    """transform() run once per distinct value of `series`, broadcast back
+    through the factorized codes (missing values stay missing)."""
+    codes, uniques = series.factorize()
+    result = transform(pd.Series(uniques, dtype=series.dtype))
+    return pd.Series(pd.api.extensions.take(result.array, codes, allow_fill=True),
+                     index=series.index)
+
+def unique_addresses(parents, postcodes=None):
+    """Steps 1–2 on factorized codes: address test, postcode and dedup run
+    once per distinct Parent task value rather than once per subtask.
+
+    Returns (rows, address_postcodes, address_rows): positions of the first
+    row of each distinct address in file order, their normalised postcodes,
+    and how many rows were addresses before deduplication. `postcodes`, if
+    given, is a precomputed per-row postcode column ("" = not an address).
+    """
+    codes, uniques = parents.factorize()
+    first = first_positions(codes)
+    if postcodes is None:
+        is_address, unique_postcodes = extract_postcodes(pd.Series(uniques, dtype=parents.dtype))
+    else:
+        unique_postcodes = postcodes.iloc[first].reset_index(drop=True)
+        is_address       = unique_postcodes != ""
+    is_address  = is_address.to_numpy(dtype=bool)
+    code_counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    return (first[is_address], unique_postcodes[is_address].reset_index(drop=True),
+            int(code_counts[is_address].sum()))
+
+def extract_uprn_value(notes_value):
+    if pd.isna(notes_value):
+        return ""
+    match = UPRN_PATTERN.search(str(notes_value))
+    return match.group(1) if match else ""
+
+def auto_detect_columns(columns):
+    cols_lower = {c.lower().strip(): c for c in columns}
+    return (
+        cols_lower.get('parent task'),
+        cols_lower.get('name'),
+        cols_lower.get('notes'),
+    )
+
+def detect_custom_fields(columns):
+    col_set = {c.strip() for c in columns}
+    return [cf for cf in KNOWN_CUSTOM_FIELDS if cf in col_set]
+
+def build_uprn_index(df, name_col, notes_col):
+    """Name → UPRN lookup Series from one str.extract over the Notes column.
+
+    Tasks with a blank name or no UPRN in their notes are skipped; when a
+    name appears more than once the last match wins.
+    """
+    empty = pd.Series(dtype=str)
+    if not name_col or not notes_col:
+        return empty
+    if notes_col not in df.columns or name_col not in df.columns:
+        return empty
+    return uprn_index_from(df[name_col], extract_uprns(df[notes_col]))
+
+def extract_uprns(notes):
+    """Vectorised extract_uprn_value: the UPRN digits, NaN where there are none.
+
+    Subtasks share blank or boilerplate Notes, so the regex runs per distinct
+    value, sharded across cores when there are many.
+    """
+    return per_unique(notes, functools.partial(apply_sharded, _uprn_matches))
+
+def _uprn_matches(notes):
+    return notes.str.extract(UPRN_PATTERN, expand=False)
+
+def uprn_index_from(names, uprns):
+    """Name → UPRN Series from aligned Name and extracted-UPRN columns."""
+    names = names.str.strip()
+    keep  = uprns.notna() & names.notna() & (names != "")
+    index = pd.Series(uprns[keep].values, index=names[keep].values, dtype=str)
+    return index[~index.index.duplicated(keep='last')]
+
+def output_columns(columns, notes_col, found_custom_fields, extract_uprn, postcode_checks=(),
+                   uprn_match=False):
+    """Final column order: Task ID | Address | Postcode | postcode checks | UPRN | custom…"""
+    keep_cols = ['Address', 'Postcode', *postcode_checks]
+    if 'Task ID' in columns:
+        keep_cols.insert(0, 'Task ID')
+    if extract_uprn and ((notes_col and notes_col in columns) or uprn_match):
+        keep_cols.append('UPRN Number')
+    if extract_uprn and uprn_match:
+        keep_cols.append(CONFIDENCE_COLUMN)
+    keep_cols += [cf for cf in found_custom_fields if cf in columns]
+    return keep_cols
+
+@dataclass(frozen=True)
+class CleanOptions:
+    """Cleaning switches; column names left as None are auto-detected."""
+    extract_uprn:     bool = True
+    parent_col:       str = None
+    name_col:         str = None
+    notes_col:        str = None
+    custom_fields:    tuple = None
+    postcode_index:   str = None    # compiled ONSPD index to validate postcodes against
+    postcode_details: bool = False  # with postcode_index: local authority and lat/long too
+    uprn_addresses:   str = None    # address/UPRN file to fill UPRNs missing from Notes
+    fuzzy_dedup:      bool = False  # also merge addresses equal once normalised, or nearly
+
+def postcode_check_columns(options):
+    """Columns the optional ONSPD check adds after Postcode."""
+    if not options.postcode_index:
+        return []
+    return [STATUS_COLUMN] + (DETAIL_COLUMNS if options.postcode_details else [])
+
+def postcode_check_stats(status):
+    """Not-found / terminated counts of a Postcode Status column."""
+    return {
+        "postcodes_not_found":  int((status == NOT_FOUND).sum()),
+        "postcodes_terminated": int((status == TERMINATED).sum()),
+    }
+
+def check_postcodes(postcodes, options):
+    """(columns, stats) from looking a Postcode column up in the ONSPD index."""
+    checked = lookup_postcodes(
+        load_postcode_index(options.postcode_index), postcodes, options.postcode_details)
+    return checked, postcode_check_stats(checked[STATUS_COLUMN])
+
+def fill_uprns(addresses, postcodes, uprns, options):
+    """(UPRN Number + confidence columns, count filled): blanks in `uprns`
+    filled by address matching against options.uprn_addresses."""
+    blank   = (uprns == '').to_numpy()
+    matched = match_uprns(load_uprn_reference(options.uprn_addresses),
+                          addresses[blank], postcodes[blank])
+    filled  = pd.DataFrame({'UPRN Number': uprns, CONFIDENCE_COLUMN: FROM_NOTES})
+    filled.loc[blank] = matched.to_numpy()
+    return filled.astype(_arrow_string_dtype()), int((matched['UPRN Number'] != '').sum())
+
+def uprn_counts(frame):
+    """UPRNs from Notes (and, after address matching, filled) in a cleaned frame."""
+    if 'UPRN Number' not in frame.columns:
+        return {"uprn_matched": 0}
+    found = frame['UPRN Number'] != ''
+    if CONFIDENCE_COLUMN not in frame.columns:
+        return {"uprn_matched": int(found.sum())}
+    from_notes = frame[CONFIDENCE_COLUMN] == FROM_NOTES
+    return {"uprn_matched": int(from_notes.sum()), "uprn_filled": int((found & ~from_notes).sum())}
+
+def resolve_columns(columns, options):
+    """(parent_col, name_col, notes_col, custom_fields) for these columns."""
+    parent_col, name_col, notes_col = auto_detect_columns(columns)
+    custom_fields = detect_custom_fields(columns)
+    return (
+        options.parent_col or parent_col,
+        options.name_col   or name_col,
+        options.notes_col  or notes_col,
+        list(options.custom_fields) if options.custom_fields is not None else custom_fields,
+    )
+
+def _missing_parent_error():
+    return ValueError(
+        'No "Parent task" column found. '
+        'Please check this is a standard Asana CSV export.'
+    )
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  LOADING
+# ═══════════════════════════════════════════════════════════════════════════════
+def _arrow_string_dtype():
+    """pandas' Arrow-backed string dtype with NaN for missing values, or the
+    Python-backed one when pyarrow isn't installed."""
+    return pd.StringDtype("pyarrow" if HAS_PYARROW else "python", na_value=float("nan"))
+
+XLSX_MAGIC = b"PK\x03\x04"   # .xlsx workbooks are ZIP archives
+
+def is_xlsx(source):
+    """True when a path or binary stream holds an Excel workbook rather than CSV."""
+    if isinstance(source, io.TextIOBase):
+        return False
+    if hasattr(source, "read"):
+        source.seek(0)
+        magic = source.read(len(XLSX_MAGIC))
+        source.seek(0)
+    else:
+        with open(source, "rb") as f:
+            magic = f.read(len(XLSX_MAGIC))
+    return magic == XLSX_MAGIC
+
+def export_size(source):
+    """Bytes an export's text takes once unpacked: the file size for a CSV,
+    the total uncompressed size of the workbook's parts for an .xlsx (whose
+    ZIP can be several times smaller than the sheet it holds).
+
+    `source` is a path, a binary stream or the raw bytes of an upload.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    if is_xlsx(source):
+        try:
+            with zipfile.ZipFile(source) as book:
+                return sum(part.file_size for part in book.infolist())
+        finally:
+            if hasattr(source, "seek"):
+                source.seek(0)
+    if hasattr(source, "seek"):
+        size = source.seek(0, io.SEEK_END)
+        source.seek(0)
+        return size
+    return os.path.getsize(source)
+
+def _open_sheet(source):
+    """(workbook, first worksheet) in openpyxl's streaming read-only mode."""
+    if hasattr(source, "seek"):
+        source.seek(0)
+    book  = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    sheet = book.worksheets[0]
+    sheet.reset_dimensions()   # else a sheet without <dimension> is scanned twice to size it
+    return book, sheet
+
+def _xlsx_header(row):
+    """Header cells as read_csv would name them (Unnamed: i, repeats as X.1)."""
+    names, seen = [], {}
+    for i, value in enumerate(row):
+        name = f"Unnamed: {i}" if value is None else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        seen.setdefault(name, 0)
+        names.append(name)
+    return names
+
+def _cell_text(value):
+    """A worksheet value as the string read_csv(dtype=str) gives for the CSV export."""
+    if value is None or isinstance(value, str):
+        return value or None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))   # Task IDs and UPRNs stored as numbers
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat() if value.time() == datetime.time() else value.isoformat(sep=" ")
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return str(value)
+
+def iter_xlsx_chunks(source, usecols=None, chunksize=STREAM_CHUNK_ROWS):
+    """Frames of up to `chunksize` rows from the first sheet of a workbook.
+
+    openpyxl's read-only mode streams the sheet XML, so only the current
+    batch is ever held. Just `usecols` (default: all) are converted, in sheet
+    order, to the same strings read_csv(dtype=str) gives; blank rows are
+    skipped like blank CSV lines.
+    """
+    book, sheet = _open_sheet(source)
+    try:
+        rows    = sheet.iter_rows(values_only=True)
+        columns = _xlsx_header(next(rows, ()))
+        wanted  = set(columns if usecols is None else usecols)
+        usecols = [c for c in columns if c in wanted]
+        picks   = [columns.index(c) for c in usecols]
+        dtype   = _arrow_string_dtype()
+        batch, emitted = [], False
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            batch.append([_cell_text(row[i]) if i < len(row) else None for i in picks])
+            if len(batch) == chunksize:
+                yield pd.DataFrame(batch, columns=usecols, dtype=object).astype(dtype)
+                batch, emitted = [], True
+        if batch or not emitted:   # an empty sheet still yields its columns
+            yield pd.DataFrame(batch, columns=usecols, dtype=object).astype(dtype)
+    finally:
+        book.close()
+
+def read_header(source):
+    """Column names only; a file-like `source` is rewound afterwards."""
+    if is_xlsx(source):
+        book, sheet = _open_sheet(source)
+        try:
+            columns = _xlsx_header(next(sheet.iter_rows(max_row=1, values_only=True), ()))
+        finally:
+            book.close()
+    else:
+        columns = list(pd.read_csv(source, dtype=str, nrows=0).columns)
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return columns
+
+def read_chunks(source, usecols, chunksize=STREAM_CHUNK_ROWS):
+    """Iterate a CSV or XLSX export as frames of `usecols`, `chunksize` rows each."""
+    if is_xlsx(source):
+        return iter_xlsx_chunks(source, usecols, chunksize)
+    return pd.read_csv(source, dtype=str, usecols=usecols, chunksize=chunksize)
+
+def needed_columns(columns, options=None):
+    """Columns the pipeline reads, in file order: Task ID, Parent task, Name,
+    Notes and the detected custom fields."""
+    parent_col, name_col, notes_col, found_custom_fields = resolve_columns(
+        columns, options or CleanOptions())
+    wanted = {'Task ID', parent_col, name_col, notes_col, *found_custom_fields}
+    return [c for c in columns if c in wanted]
+
+def _read_csv_arrow(source, usecols):
+    """pyarrow.csv read of `usecols` as strings, matching read_csv(dtype=str).
+
+    Called directly rather than via engine="pyarrow" because Notes hold
+    quoted newlines, which need newlines_in_values.
+    """
+    table = pa_csv.read_csv(
+        source,
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=usecols,
+            column_types={c: pa.string() for c in usecols},
+            null_values=sorted(STR_NA_VALUES),
+            strings_can_be_null=True,
+        ),
+    )
+    dtype = _arrow_string_dtype()
+    return table.to_pandas(types_mapper=lambda t: dtype if t == pa.string() else None)
+
+def read_export(source, options=None):
+    """Parse an export, projecting to needed_columns() before anything is built.
+
+    Uses the multithreaded pyarrow CSV reader and Arrow-backed strings when
+    pyarrow is installed and `source` is a path or binary stream; otherwise
+    (or when the header repeats a column name) the C engine with dtype=str.
+    Excel workbooks are streamed with iter_xlsx_chunks.
+    """
+    columns = read_header(source)
+    usecols = needed_columns(columns, options)
+    if is_xlsx(source):
+        return pd.concat(iter_xlsx_chunks(source, usecols), ignore_index=True)
+    if HAS_PYARROW and not isinstance(source, io.TextIOBase) \
+            and len(set(columns)) == len(columns):
+        return _read_csv_arrow(source, usecols)
+    return pd.read_csv(source, usecols=usecols, dtype=str)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  INSTRUMENTATION
+# ═══════════════════════════════════════════════════════════════════════════════
+perf_log = logging.getLogger("asana_cleaner.perf")
+
+def _rss_bytes():
+    """Current resident set size, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+class StageProfiler:
+    """Wall time, rows in/out and memory delta for each pipeline stage.
+
+    Re-entering a stage name (once per chunk in streaming mode) adds to the
+    same record. While tracemalloc is running the traced peak is kept too.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self._by_name = {}
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        record = self._by_name.get(name)
+        if record is None:
+            record = {"stage": name, "seconds": 0.0, "rows_in": None,
+                      "rows_out": None, "mem_delta_mb": None}
+            self._by_name[name] = record
+            self.stages.append(record)
+        current = {"rows_out": None}
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        rss_before = _rss_bytes()
+        start      = time.perf_counter()
+        try:
+            yield current
+        finally:
+            record["seconds"] += time.perf_counter() - start
+            rss_after = _rss_bytes()
+            if rss_before is not None and rss_after is not None:
+                delta = (rss_after - rss_before) / 2**20
+                record["mem_delta_mb"] = (record["mem_delta_mb"] or 0.0) + delta
+            if tracing:
+                peak = tracemalloc.get_traced_memory()[1] / 2**20
+                record["traced_peak_mb"] = max(record.get("traced_peak_mb", 0.0), peak)
+            for key, value in (("rows_in", rows_in), ("rows_out", current["rows_out"])):
+                if value is not None:
+                    record[key] = (record[key] or 0) + value
+
+    def total_seconds(self):
+        return sum(record["seconds"] for record in self.stages)
+
+def log_run(profiler, stats, **context):
+    """Emit one structured JSON line for a cleaning run on the perf logger."""
+    counts = {k: v for k, v in stats.items() if isinstance(v, (int, float))}
+    perf_log.info(json.dumps({
+        "event":         "clean_run",
+        **context,
+        **counts,
+        "total_seconds": round(profiler.total_seconds(), 4),
+        "stages": [
+            {k: round(v, 4) if isinstance(v, float) else v for k, v in record.items()}
+            for record in profiler.stages
+        ],
+    }))
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  OUTPUT
+# ═══════════════════════════════════════════════════════════════════════════════
+OUTPUT_FORMATS = {   # format -> (label, extension, MIME type)
+    "csv":     ("CSV",           ".csv",     "text/csv"),
+    "csv.gz":  ("CSV (gzip)",    ".csv.gz",  "application/gzip"),
+    "xlsx":    ("Excel (.xlsx)", ".xlsx",    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "parquet": ("Parquet",       ".parquet", "application/vnd.apache.parquet"),
+}
+XLSX_MAX_ROWS   = 1_048_576
+XLSX_BATCH_ROWS = 10_000
+GZIP_LEVEL      = 6   # zlib's default: most of level 9's ratio at a fraction of the time
+
+class CsvWriter:
+    """Appends cleaned chunks to a text or binary stream as UTF-8 CSV."""
+
+    def __init__(self, out, columns):
+        self.out, self.columns = out, list(columns)
+        pd.DataFrame(columns=self.columns).to_csv(out, index=False)
+
+    def write(self, chunk):
+        chunk[self.columns].to_csv(self.out, index=False, header=False)
+
+    def close(self):
+        pass
+
+class GzipCsvWriter(CsvWriter):
+    """CsvWriter through gzip, compressing each chunk as it is written."""
+
+    def __init__(self, out, columns):
+        # mtime=0 keeps the bytes identical for identical output
+        self.gzip = gzip.GzipFile(fileobj=out, mode="wb", compresslevel=GZIP_LEVEL, mtime=0)
+        super().__init__(self.gzip, columns)
+
+    def close(self):
+        self.gzip.close()
+
+class XlsxWriter:
+    """openpyxl write-only workbook: rows go straight to the sheet's XML, so
+    memory stays flat however many chunks are written. Every value is kept as
+    text so Task IDs and UPRNs don't lose digits in Excel."""
+
+    def __init__(self, out, columns, sheet="Cleaned"):
+        self.out, self.columns, self.rows = out, list(columns), 0
+        self.book  = openpyxl.Workbook(write_only=True)
+        self.sheet = self.book.create_sheet(sheet)
+        self.sheet.append(self.columns)
+
+    def write(self, chunk):
+        self.rows += len(chunk)
+        if self.rows >= XLSX_MAX_ROWS:
+            raise ValueError(f"Too many rows for one Excel sheet ({XLSX_MAX_ROWS:,} max).")
+        for start in range(0, len(chunk), XLSX_BATCH_ROWS):
+            batch = chunk[self.columns].iloc[start:start + XLSX_BATCH_ROWS].fillna("")
+            batch = batch.replace(ILLEGAL_CHARACTERS_RE, "", regex=True)
+            for row in batch.itertuples(index=False, name=None):
+                self.sheet.append([value or None for value in row])   # None = blank cell
+
+    def close(self):
+        self.book.save(self.out)
+
+class ParquetWriter:
+    """One Parquet row group per chunk, every column as a string."""
+
+    def __init__(self, out, columns):
+        if not HAS_PYARROW:
+            raise ValueError("Parquet output needs pyarrow installed.")
+        self.columns = list(columns)
+        self.schema  = pa.schema([(c, pa.string()) for c in self.columns])
+        self.writer  = pq.ParquetWriter(out, self.schema)
+
+    def write(self, chunk):
+        self.writer.write_table(
+            pa.Table.from_pandas(chunk[self.columns], schema=self.schema, preserve_index=False))
+
+    def close(self):
+        self.writer.close()
+
+WRITERS = {"csv": CsvWriter, "csv.gz": GzipCsvWriter, "xlsx": XlsxWriter, "parquet": ParquetWriter}
+
+def output_formats():
+    """Formats this install can write (Parquet needs pyarrow)."""
+    return [fmt for fmt in OUTPUT_FORMATS if fmt != "parquet" or HAS_PYARROW]
+
+def output_file_name(name, fmt="csv", prefix="cleaned_", keep_extension=False):
+    """cleaned_<stem><ext> for an upload called `name` (cleaned_<name><ext>
+    with `keep_extension`)."""
+    stem = name if keep_extension else os.path.splitext(name)[0]
+    return prefix + stem + OUTPUT_FORMATS[fmt][1]
+
+def clashing_names(names):
+    """Names that share their stem with another name (x.csv and x.xlsx), whose
+    outputs must keep the source extension so they don't overwrite each other."""
+    stems  = [os.path.splitext(name)[0].lower() for name in names]
+    shared = {stem for stem in stems if stems.count(stem) > 1}
+    return {name for name, stem in zip(names, stems) if stem in shared}
+
+def write_output(df, out, fmt="csv", chunksize=STREAM_CHUNK_ROWS):
+    """Serialize a cleaned frame to the stream `out` in `fmt`, `chunksize` rows at a time."""
+    writer = WRITERS[fmt](out, df.columns)
+    for start in range(0, len(df), chunksize):
+        writer.write(df.iloc[start:start + chunksize])
+    writer.close()
+
+def output_bytes(df, fmt="csv"):
+    """A cleaned frame as the bytes of a `fmt` file.
+
+    BytesIO.getvalue() hands over its buffer rather than copying it, so the
+    serialized file is the only full-size copy.
+    """
+    buffer = io.BytesIO()
+    write_output(df, buffer, fmt)
+    return buffer.getvalue()
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  PIPELINE
+# ═══════════════════════════════════════════════════════════════════════════════
+def _post_clean(df, address_col, options, profiler):
+    """Steps 2b, 3b and 4b, shared by every backend, on deduplicated rows that
+    already carry Postcode (and UPRN Number from Notes, when extracted).
+
+    Runs the optional fuzzy dedup, ONSPD check and UPRN matching by address.
+    Returns (df, stats): uprn_matched plus the stats of the steps that ran.
+    """
+    # Step 2b — optional: merge addresses that match once normalised, or nearly
+    fuzzy_stats = {}
+    if options.fuzzy_dedup:
+        with profiler.stage("fuzzy_dedup", rows_in=len(df)) as stage:
+            duplicate, merged_into, similarity = near_duplicates(
+                df[address_col], df['Postcode'].reset_index(drop=True))
+            fuzzy_stats = {
+                "fuzzy_dupes_removed": int(duplicate.sum()),
+                "fuzzy_merges": merge_report(df[address_col], duplicate,
+                                             merged_into, similarity),
+            }
+            df = df[~duplicate]
+            stage["rows_out"] = len(df)
+
+    # Step 3b — optional ONSPD check: live / terminated / unknown postcode
+    postcode_stats = {}
+    if options.postcode_index:
+        with profiler.stage("validate", rows_in=len(df)) as stage:
+            checked, postcode_stats = check_postcodes(df['Postcode'], options)
+            df = df.assign(**checked)
+            stage["rows_out"] = len(df)
+
+    uprn_matched = int((df['UPRN Number'] != '').sum()) if 'UPRN Number' in df else 0
+
+    # Step 4b — optional: fill UPRNs missing from Notes by address matching
+    uprn_stats = {}
+    if options.extract_uprn and options.uprn_addresses:
+        with profiler.stage("uprn_match", rows_in=len(df)) as stage:
+            uprns = df.get('UPRN Number', pd.Series('', index=df.index))
+            filled, uprn_filled = fill_uprns(df[address_col], df['Postcode'], uprns, options)
+            df = df.assign(**filled)
+            uprn_stats = {"uprn_filled": uprn_filled}
+            stage["rows_out"] = len(df)
+
+    return df, {"uprn_matched": uprn_matched, **postcode_stats, **uprn_stats, **fuzzy_stats}
+
+def clean_asana_export(df, options=None, profiler=None, postcodes=None, uprns=None):
+    """Run Steps 1–7 on an export read with dtype=str.
+
+    Returns (cleaned_df, stats) where stats holds the counts shown in the
+    app's stat grid. Pass a StageProfiler to get per-step timings. Callers
+    that already know some results (incremental mode) can pass `postcodes`
+    (normalised postcode per row, "" for non-addresses) and/or `uprns`
+    (extract_uprns of Notes), both aligned to `df`. Raises ValueError if
+    there is no Parent task column.
+    """
+    options  = options or CleanOptions()
+    profiler = profiler or StageProfiler()
+    columns  = list(df.columns)
+    parent_col, name_col, notes_col, found_custom_fields = resolve_columns(columns, options)
+    if not parent_col:
+        raise _missing_parent_error()
+    original_count = len(df)
+
+    # Step 1 — filter to address rows, one regex pass per distinct Parent task
+    with profiler.stage("filter", rows_in=original_count) as stage:
+        rows, address_postcodes, before_dedup = unique_addresses(df[parent_col], postcodes)
+        stage["rows_out"] = before_dedup
+
+    # Step 2 — deduplicate: keep the first row of each address code
+    with profiler.stage("dedup", rows_in=before_dedup) as stage:
+        filtered_df   = df.iloc[rows].copy()
+        final_count   = len(filtered_df)
+        dupes_removed = before_dedup - final_count
+        removed_count = original_count - final_count
+        stage["rows_out"] = final_count
+
+    # Step 3 — postcode column
+    with profiler.stage("postcode", rows_in=final_count) as stage:
+        filtered_df['Postcode'] = address_postcodes.set_axis(filtered_df.index)
+        stage["rows_out"] = final_count
+
+    # Step 4 — UPRN extraction
+    if options.extract_uprn and notes_col and notes_col in df.columns:
+        with profiler.stage("uprn", rows_in=original_count) as stage:
+            if uprns is not None and name_col and name_col in df.columns:
+                uprn_index = uprn_index_from(df[name_col], uprns)
+            else:
+                uprn_index = build_uprn_index(df, name_col, notes_col)
+            # str even when no Name matches and map() leaves only NaN
+            filtered_df['UPRN Number'] = (
+                filtered_df[parent_col].str.strip().map(uprn_index).fillna('')
+                .astype(_arrow_string_dtype())
+            )
+            stage["rows_out"] = final_count
+
+    # Steps 2b, 3b and 4b — optional fuzzy dedup, ONSPD check, UPRNs by address
+    filtered_df, post_stats = _post_clean(filtered_df, parent_col, options, profiler)
+    final_count   = len(filtered_df)
+    removed_count = original_count - final_count
+
+    # Step 5 — custom fields
+    with profiler.stage("custom_fields", rows_in=final_count) as stage:
+        for cf in found_custom_fields:
+            if cf in df.columns:
+                filtered_df[cf] = df.loc[filtered_df.index, cf].values
+        stage["rows_out"] = final_count
+
+    # Step 6 — rename parent_col → Address
+    with profiler.stage("rename", rows_in=final_count) as stage:
+        filtered_df = filtered_df.rename(columns={parent_col: 'Address'})
+        stage["rows_out"] = final_count
+
+    # Step 7 — final column order: Task ID | Address | Postcode | UPRN | custom…
+    with profiler.stage("reorder", rows_in=final_count) as stage:
+        keep_cols   = output_columns(columns, notes_col, found_custom_fields,
+                                     options.extract_uprn, postcode_check_columns(options),
+                                     bool(options.uprn_addresses))
+        filtered_df = filtered_df[keep_cols]
+        stage["rows_out"] = final_count
+
+    return filtered_df, {
+        "original_count": original_count,
+        "final_count":    final_count,
+        "dupes_removed":  dupes_removed,
+        "removed_count":  removed_count,
+        **post_stats,
+    }
+
+def clean_csv_streaming(source, output, options=None, chunksize=STREAM_CHUNK_ROWS, profiler=None,
+                        fmt="csv"):
+    """Bounded-memory clean: read `source` in chunks and append rows to `output`.
+
+    A first, narrow pass over Name/Notes builds the UPRN map; the second pass
+    reads only the columns that reach the output and keeps a running set of
+    seen Parent task values so duplicates are dropped across chunk borders.
+    `source` (CSV or XLSX) must be seekable; `output` must be binary unless
+    `fmt` is csv. Returns the same stats as clean_asana_export; a
+    StageProfiler sums each stage over all chunks.
+    """
+    options  = options or CleanOptions()
+    profiler = profiler or StageProfiler()
+    source.seek(0)
+    columns = read_header(source)
+    parent_col, name_col, notes_col, found_custom_fields = resolve_columns(columns, options)
+    if not parent_col:
+        raise _missing_parent_error()
+    out_cols    = output_columns(columns, notes_col, found_custom_fields,
+                                 options.extract_uprn, postcode_check_columns(options),
+                                 bool(options.uprn_addresses))
+    custom_cols = [cf for cf in found_custom_fields if cf in columns]
+
+    # Pass 1 — UPRN map (last match wins, across chunks too)
+    uprn_map = {}
+    if 'UPRN Number' in out_cols and name_col and notes_col in columns:
+        with profiler.stage("uprn_map") as stage:
+            source.seek(0)
+            for chunk in read_chunks(source, [name_col, notes_col], chunksize):
+                uprn_map.update(build_uprn_index(chunk, name_col, notes_col).to_dict())
+            stage["rows_out"] = len(uprn_map)
+
+    # Pass 2 — filter, dedup, postcode, UPRN, write
+    read_cols = [c for c in ['Task ID', parent_col] + custom_cols if c in columns]
+    read_cols = list(dict.fromkeys(read_cols))
+    writer = WRITERS[fmt](output, out_cols)
+
+    seen           = set()
+    original_count = 0
+    before_dedup   = 0
+    final_count    = 0
+    post_stats     = {"uprn_matched": 0}
+    chunk_options  = replace(options, fuzzy_dedup=False)   # fuzzy dedup spans chunks
+    fuzzy_removed  = 0
+    history        = []   # fuzzy_dedup: Address/Postcode of every distinct address so far
+    merges         = []
+
+    source.seek(0)
+    reader = read_chunks(source, read_cols, chunksize)
+    while True:
+        with profiler.stage("read_csv") as stage:
+            chunk = next(reader, None)
+            stage["rows_out"] = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            break
+        original_count += len(chunk)
+
+        with profiler.stage("filter", rows_in=len(chunk)) as stage:
+            rows, postcodes, address_rows = unique_addresses(chunk[parent_col])
+            before_dedup += address_rows
+            stage["rows_out"] = address_rows
+
+        with profiler.stage("dedup", rows_in=address_rows) as stage:
+            new   = ~chunk[parent_col].iloc[rows].isin(seen).to_numpy()
+            chunk = chunk.iloc[rows[new]]
+            chunk_postcodes = postcodes[new].reset_index(drop=True)
+            seen.update(chunk[parent_col])
+            final_count += len(chunk)
+            stage["rows_out"] = len(chunk)
+
+        with profiler.stage("postcode", rows_in=len(chunk)) as stage:
+            chunk = chunk.assign(Postcode=chunk_postcodes.to_numpy())
+            stage["rows_out"] = len(chunk)
+
+        if 'UPRN Number' in out_cols:
+            with profiler.stage("uprn", rows_in=len(chunk)) as stage:
+                chunk['UPRN Number'] = chunk[parent_col].str.strip().map(uprn_map).fillna('') \
+                    .astype(_arrow_string_dtype())
+                stage["rows_out"] = len(chunk)
+
+        # Near-duplicates only occur within a postcode, so comparing against
+        # the earlier addresses in this chunk's postcodes matches a full run
+        if options.fuzzy_dedup:
+            with profiler.stage("fuzzy_dedup", rows_in=len(chunk)) as stage:
+                prior = [h[h['Postcode'].isin(chunk['Postcode'])] for h in history]
+                history.append(pd.DataFrame({'Address':  chunk[parent_col].to_numpy(),
+                                             'Postcode': chunk['Postcode'].to_numpy()}))
+                combined = pd.concat(prior + history[-1:], ignore_index=True)
+                duplicate, merged_into, similarity = near_duplicates(
+                    combined['Address'], combined['Postcode'])
+                duplicate[:len(combined) - len(chunk)] = False
+                merges.append(merge_report(combined['Address'], duplicate, merged_into, similarity))
+
+                keep           = ~duplicate[len(combined) - len(chunk):]
+                chunk          = chunk[keep]
+                fuzzy_removed += int((~keep).sum())
+                final_count   -= int((~keep).sum())
+                stage["rows_out"] = len(chunk)
+
+        # Steps 3b and 4b — optional ONSPD check and UPRNs by address
+        chunk, chunk_stats = _post_clean(chunk, parent_col, chunk_options, profiler)
+        post_stats = {k: post_stats.get(k, 0) + n for k, n in chunk_stats.items()}
+
+        with profiler.stage(f"to_{fmt}", rows_in=len(chunk)) as stage:
+            writer.write(chunk.rename(columns={parent_col: 'Address'}))
+            stage["rows_out"] = len(chunk)
+
+    with profiler.stage(f"to_{fmt}"):
+        writer.close()
+
+    fuzzy_stats = {}
+    if options.fuzzy_dedup:
+        fuzzy_stats = {
+            "fuzzy_dupes_removed": fuzzy_removed,
+            "fuzzy_merges":        pd.concat(merges, ignore_index=True) if merges
+                                   else pd.DataFrame(columns=MERGE_COLUMNS, dtype=str),
+        }
+
+    return {
+        "original_count": original_count,
+        "final_count":    final_count,
+        "dupes_removed":  before_dedup - final_count - fuzzy_removed,
+        "removed_count":  original_count - final_count,
+        **post_stats,
+        **fuzzy_stats,
+    }
+
+def clean_export_file(source, options=None):
+    """read_export + clean_asana_export for one export; a picklable pool worker.
+
+    `source` is a path, a binary stream or the raw bytes of an upload.
+    Returns (cleaned_df, stats, profiler) with read_csv timed as a stage.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    profiler = StageProfiler()
+    with profiler.stage("read_csv") as stage:
+        df = read_export(source, options)
+        stage["rows_out"] = len(df)
+    cleaned, stats = clean_asana_export(df, options, profiler)
+    return cleaned, stats, profiler
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  PREVIEW
+# ═══════════════════════════════════════════════════════════════════════════════
+def read_sample(source, max_bytes, options=None, chunksize=PREVIEW_CHUNK_ROWS):
+    """The leading rows of a seekable export, about `max_bytes` of it, with
+    read_export's columns. Reading stops at the first chunk boundary past
+    `max_bytes`, so quoted multi-line Notes are never cut.
+
+    Returns (df, fraction): the share of the file's bytes the rows came
+    from, 1.0 when the whole file was read.
+    """
+    columns = read_header(source)
+    usecols = needed_columns(columns, options)
+    size    = source.seek(0, io.SEEK_END)
+    source.seek(0)
+    chunks, fraction = [], 1.0
+    reader = read_chunks(source, usecols, chunksize)
+    try:
+        for chunk in reader:
+            chunks.append(chunk)
+            if source.tell() >= max_bytes:
+                fraction = min(source.tell() / size, 1.0)
+                break
+    finally:
+        reader.close()   # detaches the parser without closing `source`
+    source.seek(0)
+    return pd.concat(chunks, ignore_index=True), fraction
+
+def estimate_stats(stats, fraction):
+    """Whole-file counts extrapolated linearly from a sample's stats.
+
+    Exports list each property's subtasks together, so a leading slice holds
+    about the same share of the addresses as of the rows.
+    """
+    scale    = 1 / fraction if fraction else 1.0
+    estimate = {k: round(stats[k] * scale)
+                for k in ("original_count", "final_count", "uprn_matched")}
+    estimate["removed_count"] = estimate["original_count"] - estimate["final_count"]
+    return estimate
+
+def preview_export(source, options=None, max_bytes=PREVIEW_MB * 2**20):
+    """clean_asana_export on the first `max_bytes` of an export.
+
+    Returns (cleaned_sample, sample_stats, estimated_stats, fraction).
+    """
+    sample, fraction = read_sample(source, max_bytes, options)
+    cleaned, stats   = clean_asana_export(sample, options)
+    return cleaned, stats, estimate_stats(stats, fraction), fraction
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  MULTI-FILE
+# ═══════════════════════════════════════════════════════════════════════════════
+def dedupe_across_files(frames):
+    """Keep each Address only in the first file it appears in.
+
+    Takes cleaned frames in upload order; returns (frames, removed_per_file).
+    """
+    seen, kept, removed = set(), [], []
+    for frame in frames:
+        dup = frame['Address'].isin(seen)
+        seen.update(frame.loc[~dup, 'Address'])
+        kept.append(frame[~dup])
+        removed.append(int(dup.sum()))
+    return kept, removed
+
+def combine_stats(per_file):
+    """Sum the counts of several runs; a count missing from a run adds 0.
+    Non-count entries (the fuzzy merge report) are left out."""
+    keys = dict.fromkeys(k for stats in per_file for k, v in stats.items()
+                         if isinstance(v, (int, float)))
+    return {k: sum(stats.get(k, 0) for stats in per_file) for k in keys}
+
+def merge_cleaned(named_frames):
+    """One frame for several cleaned files, tagged with a leading Source File
+    column; custom fields missing from a file are left blank."""
+    merged = pd.concat(
+        [frame.assign(**{'Source File': name}) for name, frame in named_frames],
+        ignore_index=True,
+    )
+    return merged[['Source File'] + [c for c in merged.columns if c != 'Source File']]
+
+def zip_cleaned(named_frames, fmt="csv"):
+    """ZIP (bytes) holding a cleaned_<name> file in `fmt` for each cleaned file."""
+    buffer = io.BytesIO()
+    clash  = clashing_names([name for name, _ in named_frames])
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, frame in named_frames:
+            member_name = output_file_name(name, fmt, keep_extension=name in clash)
+            with archive.open(member_name, "w", force_zip64=True) as member:
+                write_output(frame, member, fmt)
+    return buffer.getvalue()
@@ -0,0 +1,204 @@
+"""Clean a folder of Asana CSV (or .xlsx) exports without the browser.
+
+    python batch_clean.py exports/ -o cleaned/ --workers 8
+
+Each export is cleaned on its own worker process (one file per worker) and
+written next to the others as cleaned_<name>.csv (or .csv.gz, .xlsx or
+.parquet with --format); exports that share a name, like x.csv and x.xlsx,
+keep their extension (cleaned_x.csv.csv, cleaned_x.xlsx.csv). Files larger
+than STREAM_THRESHOLD_MB (an .xlsx by its unpacked size) go through the
+bounded-memory streaming path so a pool of big exports can't exhaust the box.
+
+With --incremental INDEX each file is diffed against its previous run (the
+project is the file name, without its extension unless another export shares
+it) and a changes_<name> file is written alongside; unchanged rows skip
+postcode and UPRN extraction.
+
+With --onspd INDEX (compiled by postcode_index.py) every postcode is checked
+against the ONS Postcode Directory; --postcode-details also adds its local
+authority and latitude/longitude. With --uprn-addresses FILE, UPRNs missing
+from Notes are filled by matching addresses against a local address/UPRN file
+(e.g. an AddressBase extract). --fuzzy-dedup also merges addresses that match
+once normalised, or nearly, within a postcode and lists them in merges_<name>.
+
+With --backend duckdb (needs duckdb installed) each CSV is cleaned by one
+DuckDB query over the file on disk instead (see duckdb_backend.py), which
+spills to disk rather than streaming, so the size threshold doesn't apply.
+"""
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from asana_cleaner import (
+    STREAM_THRESHOLD_MB,
+    CleanOptions,
+    StageProfiler,
+    clashing_names,
+    clean_csv_streaming,
+    clean_export_file,
+    export_size,
+    log_run,
+    output_file_name,
+    output_formats,
+    perf_log,
+    read_export,
+    write_output,
+)
+from duckdb_backend import backends, clean_export_duckdb
+from incremental import AddressIndex, clean_incremental
+
+EXPORT_SUFFIXES = (".csv", ".xlsx")
+
+
+def clean_file(in_path, output_dir, options, fmt="csv", index_path=None, backend="pandas",
+               keep_extension=False):
+    """Worker: clean one export from disk to disk; returns (stats, profiler, streaming).
+
+    `keep_extension` names the outputs after the whole file name, for exports
+    whose stem another export in the batch shares.
+    """
+    if index_path:
+        return clean_file_incremental(in_path, output_dir, options, fmt, index_path,
+                                      keep_extension)
+    out_path  = output_dir / output_file_name(in_path.name, fmt, keep_extension=keep_extension)
+    streaming = backend == "pandas" and \
+        export_size(in_path) > STREAM_THRESHOLD_MB * 1024 * 1024
+    if streaming:
+        profiler = StageProfiler()
+        with open(in_path, "rb") as src, open(out_path, "wb") as out:
+            stats = clean_csv_streaming(src, out, options, profiler=profiler, fmt=fmt)
+        write_merges(stats, in_path, output_dir, fmt, keep_extension)
+        return stats, profiler, streaming
+
+    if backend == "duckdb":
+        cleaned, stats, profiler = clean_export_duckdb(in_path, options)
+    else:
+        cleaned, stats, profiler = clean_export_file(in_path, options)
+    with profiler.stage(f"to_{fmt}", rows_in=len(cleaned)) as stage, open(out_path, "wb") as out:
+        write_output(cleaned, out, fmt)
+        stage["rows_out"] = len(cleaned)
+    write_merges(stats, in_path, output_dir, fmt, keep_extension)
+    return stats, profiler, streaming
+
+
+def clean_file_incremental(in_path, output_dir, options, fmt, index_path, keep_extension=False):
+    """Worker: like clean_file, diffing against `index_path` and writing changes_<name>."""
+    profiler = StageProfiler()
+    with profiler.stage("read_csv") as stage:
+        df = read_export(in_path, options)
+        stage["rows_out"] = len(df)
+    with AddressIndex(index_path) as index:
+        project = in_path.name if keep_extension else in_path.stem
+        cleaned, changes, stats = clean_incremental(df, index, project, options, profiler)
+    with profiler.stage(f"to_{fmt}", rows_in=len(cleaned)) as stage:
+        for frame, prefix in ((cleaned, "cleaned_"), (changes, "changes_")):
+            name = output_file_name(in_path.name, fmt, prefix, keep_extension)
+            with open(output_dir / name, "wb") as out:
+                write_output(frame, out, fmt)
+        stage["rows_out"] = len(cleaned)
+    write_merges(stats, in_path, output_dir, fmt, keep_extension)
+    return stats, profiler, False
+
+
+def write_merges(stats, in_path, output_dir, fmt, keep_extension=False):
+    """With fuzzy dedup, write merges_<name>: each near-duplicate and what it merged
+    into. The report is popped from `stats` so it is not sent back to the parent."""
+    if "fuzzy_merges" in stats:
+        name = output_file_name(in_path.name, fmt, "merges_", keep_extension)
+        with open(output_dir / name, "wb") as out:
+            write_output(stats.pop("fuzzy_merges"), out, fmt)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Clean every Asana export in a folder.")
+    parser.add_argument("input_dir", type=Path, help="folder containing Asana .csv / .xlsx exports")
+    parser.add_argument("-o", "--output-dir", type=Path,
+                        help="where cleaned files go (default: <input_dir>/cleaned)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="worker processes (default: all cores)")
+    parser.add_argument("-f", "--format", choices=output_formats(), default="csv",
+                        help="output file format (default: csv)")
+    parser.add_argument("--no-uprn", action="store_true",
+                        help="skip UPRN extraction from Notes")
+    parser.add_argument("--incremental", type=Path, metavar="INDEX",
+                        help="SQLite index of earlier runs; also write changes_<name>")
+    parser.add_argument("--fuzzy-dedup", action="store_true",
+                        help="also merge near-duplicate addresses; writes merges_<name>")
+    parser.add_argument("--uprn-addresses", metavar="FILE",
+                        help="address/UPRN CSV to fill UPRNs missing from Notes")
+    parser.add_argument("--onspd", metavar="INDEX",
+                        help="compiled ONSPD index to validate postcodes against")
+    parser.add_argument("--postcode-details", action="store_true",
+                        help="with --onspd, add local authority and lat/long columns")
+    parser.add_argument("--backend", choices=backends(), default="pandas",
+                        help="cleaning engine (default: pandas)")
+    parser.add_argument("--log-json", action="store_true",
+                        help="print one JSON performance line per file to stderr")
+    args = parser.parse_args(argv)
+    if args.backend != "pandas" and args.incremental:
+        parser.error("--incremental runs on the pandas backend only")
+    if args.no_uprn and args.uprn_addresses:
+        parser.error("--uprn-addresses fills UPRNs, so it can't be used with --no-uprn")
+    return args
+
+
+def main(argv=None):
+    args       = parse_args(argv)
+    output_dir = args.output_dir or args.input_dir / "cleaned"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    options    = CleanOptions(extract_uprn=not args.no_uprn, postcode_index=args.onspd,
+                              postcode_details=args.postcode_details,
+                              uprn_addresses=args.uprn_addresses,
+                              fuzzy_dedup=args.fuzzy_dedup)
+    if args.log_json:
+        logging.basicConfig(format="%(message)s")
+        perf_log.setLevel(logging.INFO)
+
+    inputs = sorted(p for p in args.input_dir.iterdir()
+                    if p.suffix.lower() in EXPORT_SUFFIXES and p.is_file())
+    if not inputs:
+        print(f"No CSV or XLSX files found in {args.input_dir}", file=sys.stderr)
+        return 1
+
+    clash  = clashing_names([path.name for path in inputs])
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(clean_file, path, output_dir, options, args.format, args.incremental,
+                        args.backend, path.name in clash): path
+            for path in inputs
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                stats, profiler, streaming = future.result()
+            except Exception as exc:  # report and carry on with the rest of the batch
+                failed += 1
+                print(f"✗ {path.name}: {exc}", file=sys.stderr)
+                continue
+            log_run(profiler, stats, file=path.name, streaming=streaming, backend=args.backend)
+            print(
+                f"✦ {path.name}: {stats['original_count']:,} rows → "
+                f"{stats['final_count']:,} addresses "
+                f"({stats['dupes_removed']:,} duplicates, {stats['uprn_matched']:,} UPRN)"
+            )
+            if args.fuzzy_dedup:
+                print(f"  {stats['fuzzy_dupes_removed']:,} near-duplicates merged")
+            if args.uprn_addresses:
+                print(f"  {stats['uprn_filled']:,} UPRNs matched by address")
+            if args.onspd:
+                print(f"  postcodes: {stats['postcodes_not_found']:,} not in ONSPD, "
+                      f"{stats['postcodes_terminated']:,} terminated")
+            if args.incremental:
+                print(f"  since last run: {stats['added']:,} added, "
+                      f"{stats['changed']:,} changed, {stats['removed']:,} removed")
+
+    print(f"Cleaned {len(inputs) - failed} of {len(inputs)} file(s) into {output_dir}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""Stage-by-stage timing and peak memory of the cleaning pipeline.
+
+    python -m benchmarks.bench_pipeline --sizes 10000 100000 1000000 --json bench.json
+
+For each size a synthetic export is written to a scratch folder, then the
+pipeline is run with a StageProfiler so every stage is timed (best of
+--repeat runs), and run once more under tracemalloc for each stage's peak
+allocation. End-to-end clean_asana_export and the
+streaming path are timed as well, so a regression or a speed-up shows up
+both per stage and overall.
+
+With duckdb installed the DuckDB backend is timed end to end too, and both
+backends' whole runs are repeated in a fresh process each so their peak RSS
+can be compared: pandas tends to win on small exports (no query planning or
+second CSV parser to start) and DuckDB on large ones, on several cores or
+within a tight memory limit, since it never builds the full export.
+
+tracemalloc sees Python and NumPy allocations but not Arrow buffers, so the
+process peak RSS (`max_rss_mb`) is reported alongside it; run one size per
+invocation when you need that number to be per-size.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import gc
+import io
+import json
+import multiprocessing
+import resource
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+
+from asana_cleaner import (
+    StageProfiler,
+    clean_asana_export,
+    clean_csv_streaming,
+    read_export,
+)
+from benchmarks.synthetic_export import write_export
+from duckdb_backend import HAS_DUCKDB, clean_export_duckdb
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+
+def profile_run(path, traced=False):
+    """One full read → clean → to_csv run; returns the StageProfiler records.
+
+    With `traced` the run happens under tracemalloc so each record also
+    carries the stage's traced peak.
+    """
+    profiler = StageProfiler()
+    gc.collect()
+    if traced:
+        tracemalloc.start()
+    try:
+        with profiler.stage("read_csv") as stage:
+            df = read_export(path)
+            stage["rows_out"] = len(df)
+        cleaned, _ = clean_asana_export(df, profiler=profiler)
+        with profiler.stage("to_csv", rows_in=len(cleaned)) as stage:
+            cleaned.to_csv(io.StringIO(), index=False)
+            stage["rows_out"] = len(cleaned)
+    finally:
+        if traced:
+            tracemalloc.stop()
+    return profiler.stages
+
+
+def run_pandas(path):
+    """End-to-end pandas backend: read → clean → to_csv."""
+    clean_asana_export(read_export(path))[0].to_csv(io.StringIO(), index=False)
+
+
+def run_duckdb(path):
+    """End-to-end DuckDB backend: query → to_csv."""
+    clean_export_duckdb(path)[0].to_csv(io.StringIO(), index=False)
+
+
+def _peak_rss(fn, path):
+    """Peak RSS in MB of fn(path) run alone in a fresh process."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(_run_for_rss, fn, path).result()
+
+
+def _run_for_rss(fn, path):
+    # ru_maxrss survives fork + exec, so it would include the parent's peak;
+    # VmHWM starts afresh in the new process image
+    fn(path)
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _best_time(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_size(path, n_rows, repeat=3, memory=True):
+    runs  = [profile_run(path) for _ in range(repeat)]
+    peaks = {r["stage"]: r["traced_peak_mb"] for r in profile_run(path, traced=True)} if memory else {}
+
+    def streaming():
+        with open(path, newline="", encoding="utf-8") as src:
+            clean_csv_streaming(src, io.StringIO())
+
+    stages = {}
+    for record in runs[0]:
+        name = record["stage"]
+        stages[name] = {
+            "seconds":  min(r["seconds"] for run in runs for r in run if r["stage"] == name),
+            "rows_in":  record["rows_in"],
+            "rows_out": record["rows_out"],
+            "peak_mb":  round(peaks[name], 1) if memory else None,
+        }
+    result = {
+        "rows": n_rows,
+        "stages": stages,
+        "end_to_end_seconds": _best_time(lambda: run_pandas(path), repeat),
+        "streaming_seconds":  _best_time(streaming, repeat),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    if HAS_DUCKDB:
+        result["duckdb_seconds"] = _best_time(lambda: run_duckdb(path), repeat)
+        if memory:
+            result["pandas_rss_mb"] = _peak_rss(run_pandas, path)
+            result["duckdb_rss_mb"] = _peak_rss(run_duckdb, path)
+    return result
+
+
+def format_report(result):
+    lines = [f"── {result['rows']:,} rows " + "─" * 40,
+             f"{'stage':<16}{'seconds':>10}{'peak MB':>10}"]
+    for name, stage in result["stages"].items():
+        peak = "" if stage["peak_mb"] is None else f"{stage['peak_mb']:.1f}"
+        lines.append(f"{name:<16}{stage['seconds']:>10.3f}{peak:>10}")
+    lines.append(f"{'end-to-end':<16}{result['end_to_end_seconds']:>10.3f}")
+    lines.append(f"{'streaming':<16}{result['streaming_seconds']:>10.3f}")
+    if "duckdb_seconds" in result:
+        lines.append(f"{'duckdb':<16}{result['duckdb_seconds']:>10.3f}")
+    if "duckdb_rss_mb" in result:
+        lines.append(f"{'peak RSS pandas':<16}{result['pandas_rss_mb']:>20.1f} MB")
+        lines.append(f"{'peak RSS duckdb':<16}{result['duckdb_rss_mb']:>20.1f} MB")
+    lines.append(f"{'process max RSS':<16}{result['max_rss_mb']:>20.1f} MB")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the cleaning pipeline per stage.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="export sizes in rows (default: 10k 100k 1M)")
+    parser.add_argument("--repeat", type=int, default=3, help="timing runs per size (best is kept)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--json", type=Path, help="also write results to this JSON file")
+    parser.add_argument("--workdir", type=Path, help="keep generated exports here")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as scratch:
+        workdir = args.workdir or Path(scratch)
+        workdir.mkdir(parents=True, exist_ok=True)
+        for n_rows in args.sizes:
+            path = workdir / f"synthetic_{n_rows}.csv"
+            if not path.exists():
+                write_export(path, n_rows)
+            result = bench_size(path, n_rows, args.repeat, memory=not args.no_memory)
+            results.append(result)
+            print(format_report(result), flush=True)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
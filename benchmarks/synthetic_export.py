@@ -0,0 +1,160 @@
+"""Synthetic Asana exports for benchmarking the cleaner.
+
+The shape follows a real portfolio export: one parent task per property whose
+Name is the address (valid, malformed or missing postcode) and whose Notes
+carry a `UPRN: 123…` line most of the time, followed by a couple of dozen
+subtasks that repeat that address in the Parent task column. A slice of
+properties is exported twice as separate parent tasks, and every
+KNOWN_CUSTOM_FIELDS column is present alongside the usual Asana columns.
+
+    python -m benchmarks.synthetic_export 1000000 -o export_1m.csv
+"""
+import argparse
+import io
+
+import numpy as np
+import pandas as pd
+
+from asana_cleaner import KNOWN_CUSTOM_FIELDS
+
+SUBTASKS_PER_PROPERTY = 24
+GENERATE_CHUNK_ROWS   = 250_000
+
+STREETS = [
+    "High Street", "High St", "Station Road", "Church Lane", "Mill Road",
+    "Park Avenue", "Victoria Road", "Green Lane", "Manor Close", "Kings Way",
+    "Queens Drive", "The Crescent", "Oak Grove", "Westfield Rd", "Bridge St",
+]
+TOWNS     = ["Leeds", "Watford", "Harrogate", "York", "Saffron Walden", "Scarborough",
+             "Luton", "Stevenage", "Selby", "Ripon", "Hemel Hempstead"]
+AREAS     = ["LS", "WD", "HG", "YO", "CB", "LU", "SG", "AL", "HP", "M", "E", "SW", "B"]
+LETTERS   = list("ABDEFGHJLNPQRSTUWXYZ")
+SUBTASKS  = [
+    "EPC survey", "Retrofit assessment", "Coordinator sign-off", "Loft insulation",
+    "Cavity wall insulation", "Air source heat pump", "Solar PV", "Ventilation",
+    "Handover pack", "Post-install EPC", "TrustMark lodgement", "Customer contact",
+]
+SECTIONS  = ["Backlog", "Surveyed", "Design", "Install", "Complete"]
+ASSIGNEES = ["", "Sam Patel", "Jo Reid", "Alex Moore", "Chris Hall"]
+STAGES    = ["", "Survey booked", "Survey done", "Design", "Install", "Signed off"]
+FILLER    = (
+    "Access via side gate. Tenant prefers morning appointments. "
+    "Previous works noted on file; check loft hatch size before booking."
+)
+
+
+def _pick(rng, choices, n):
+    return pd.Series(np.asarray(choices, dtype=object)[rng.integers(0, len(choices), n)])
+
+
+def _numbers(rng, low, high, n):
+    return pd.Series(rng.integers(low, high, n)).astype(str)
+
+
+def _postcodes(rng, n):
+    """Mostly valid UK postcodes in the formats people type, plus bad ones."""
+    outward = _pick(rng, AREAS, n) + _numbers(rng, 1, 30, n)
+    inward  = _numbers(rng, 0, 10, n) + _pick(rng, LETTERS, n) + _pick(rng, LETTERS, n)
+    spaced  = outward + " " + inward
+    style   = rng.random(n)
+    return pd.Series(np.select(
+        [style < 0.55, style < 0.75, style < 0.85, style < 0.92, style < 0.96],
+        [
+            spaced,                              # AB1 2CD
+            outward + inward,                    # AB12CD
+            spaced.str.lower(),                  # ab1 2cd
+            outward + "  " + inward,             # AB1  2CD
+            outward + " " + inward.str[:2],      # AB1 2C (malformed)
+        ],
+        default="",                              # no postcode at all
+    ))
+
+
+def make_properties(n_properties, seed=0):
+    """Address and UPRN for each distinct property (some addresses invalid)."""
+    rng    = np.random.default_rng(seed)
+    flat   = ("Flat " + _numbers(rng, 1, 20, n_properties) + ", ").where(
+        pd.Series(rng.random(n_properties)) < 0.15, "")
+    street = _numbers(rng, 1, 250, n_properties) + " " + _pick(rng, STREETS, n_properties)
+    town   = _pick(rng, TOWNS, n_properties)
+    sep    = _pick(rng, [", ", " "], n_properties)
+    address = (flat + street + ", " + town + sep + _postcodes(rng, n_properties)).str.strip(" ,")
+    uprn    = _numbers(rng, 10_000_000, 100_099_999_999, n_properties)
+    return pd.DataFrame({"address": address, "uprn": uprn})
+
+
+def generate_chunk(properties, start_row, n_rows, seed=0, duplicate_rate=0.03, uprn_rate=0.8):
+    """`n_rows` export rows for `properties`, with Task IDs starting at `start_row`."""
+    rng       = np.random.default_rng(seed + start_row)
+    block     = SUBTASKS_PER_PROPERTY + 1
+    row_ids   = np.arange(start_row, start_row + n_rows)
+    prop_idx  = (row_ids // block) % len(properties)
+    is_parent = pd.Series((row_ids % block) == 0)
+    address   = properties["address"].iloc[prop_idx].reset_index(drop=True)
+    uprn      = properties["uprn"].iloc[prop_idx].reset_index(drop=True)
+
+    # Parent tasks: Name is the address, Notes usually carry the UPRN.
+    uprn_line    = ("UPRN: " + uprn).where(pd.Series(rng.random(n_rows)) < 0.5, "UPRN:" + uprn)
+    parent_notes = (uprn_line + "\n" + FILLER).where(
+        pd.Series(rng.random(n_rows)) < uprn_rate, FILLER)
+    # A few properties were exported twice: an extra parent task with the same name.
+    dup_parent   = ~is_parent & (pd.Series(rng.random(n_rows)) < duplicate_rate / block)
+    sub_name     = address.where(dup_parent, _pick(rng, SUBTASKS, n_rows))
+    task_notes   = pd.Series(np.where(rng.random(n_rows) < 0.3, FILLER, ""), dtype=object)
+    sub_notes    = parent_notes.where(dup_parent, task_notes)
+
+    created = (pd.Timestamp("2024-01-01")
+               + pd.to_timedelta(row_ids % 600, unit="D")).strftime("%Y-%m-%d")
+    frame = pd.DataFrame({
+        "Task ID":        pd.Series(1_200_000_000_000_000 + row_ids).astype(str),
+        "Created At":     created,
+        "Completed At":   pd.Series(created).where(pd.Series(rng.random(n_rows)) < 0.4, ""),
+        "Last Modified":  created,
+        "Name":           address.where(is_parent, sub_name),
+        "Section/Column": _pick(rng, SECTIONS, n_rows),
+        "Assignee":       _pick(rng, ASSIGNEES, n_rows),
+        "Assignee Email": "",
+        "Start Date":     "",
+        "Due Date":       "",
+        "Tags":           "",
+        "Notes":          parent_notes.where(is_parent, sub_notes),
+        "Projects":       "Retrofit Portfolio",
+        "Parent task":    address.where(~is_parent & ~dup_parent, ""),
+    })
+    for cf in KNOWN_CUSTOM_FIELDS:
+        frame[cf] = _pick(rng, STAGES, n_rows)
+    return frame
+
+
+def _n_properties(n_rows):
+    return max(1, n_rows // (SUBTASKS_PER_PROPERTY + 1))
+
+
+def generate_export(n_rows, seed=0):
+    """Whole synthetic export as the app would parse it (read_csv, dtype=str)."""
+    frame = generate_chunk(make_properties(_n_properties(n_rows), seed), 0, n_rows, seed)
+    return pd.read_csv(io.StringIO(frame.to_csv(index=False)), dtype=str)
+
+
+def write_export(path, n_rows, seed=0, chunk_rows=GENERATE_CHUNK_ROWS):
+    """Write an `n_rows` export to `path` chunk by chunk (fine for 5M+ rows)."""
+    properties = make_properties(_n_properties(n_rows), seed)
+    with open(path, "w", newline="", encoding="utf-8") as out:
+        for start in range(0, n_rows, chunk_rows):
+            chunk = generate_chunk(properties, start, min(chunk_rows, n_rows - start), seed)
+            chunk.to_csv(out, index=False, header=start == 0)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic Asana CSV export.")
+    parser.add_argument("rows", type=int, help="number of task rows (e.g. 10000 … 5000000)")
+    parser.add_argument("-o", "--output", help="CSV path (default: synthetic_<rows>.csv)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    path = write_export(args.output or f"synthetic_{args.rows}.csv", args.rows, args.seed)
+    print(f"Wrote {args.rows:,} rows to {path}")
+
+
+if __name__ == "__main__":
+    main()
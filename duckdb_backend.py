@@ -0,0 +1,216 @@
+"""Out-of-core cleaning of a CSV export with an embedded DuckDB engine.
+
+clean_asana_export needs the whole export in memory as a DataFrame.
+clean_export_duckdb instead runs Steps 1–7 as one SQL query over the CSV
+file on disk: the postcode regex, first-occurrence dedup, the Name → UPRN
+join and the column projection. DuckDB reads only the columns the query
+uses, runs on every core and spills to disk past its memory limit, so only
+the cleaned rows are ever built as a DataFrame.
+
+The cleaned rows, their index and column order, and the stats are identical
+to the pandas backend's:
+
+* UK_POSTCODE and UPRN_PATTERN are rewritten for RE2 with Python's Unicode
+  \\b, \\s and \\d spelled out, and trim() is given str.strip()'s whitespace.
+* Rows are numbered as they are read; each Parent task keeps its first row
+  and the last UPRN per Name wins, by that number.
+* The optional fuzzy dedup, ONSPD check and address UPRN matching work row
+  by row on the cleaned addresses, so they run on the result through the
+  same helper as the pandas backends.
+
+XLSX exports, and CSVs whose header repeats a column name, are cleaned by
+the pandas backend, since read_export handles those cases specially.
+"""
+import sys
+import tempfile
+
+import pandas as pd
+from pandas._libs.parsers import STR_NA_VALUES
+
+from asana_cleaner import (
+    CleanOptions,
+    StageProfiler,
+    _arrow_string_dtype,
+    _missing_parent_error,
+    _post_clean,
+    clean_export_file,
+    is_xlsx,
+    output_columns,
+    postcode_check_columns,
+    read_header,
+    resolve_columns,
+)
+
+try:
+    import duckdb
+    import pyarrow as pa
+    HAS_DUCKDB = True
+except ImportError:
+    HAS_DUCKDB = False
+
+BACKENDS = ["pandas", "duckdb"]
+
+# Python's Unicode \w, \s and \d as RE2 class contents; RE2 has no lookaround,
+# so \b around the postcode becomes a consumed non-word character (or ^ / $)
+_WORD       = r"\pL\pN_"
+_SPACE      = r"\t\n\x0b\f\r\x1c-\x1f \x85\pZ"
+_DIGIT      = r"\p{Nd}"
+POSTCODE_RE = (rf"(?i)(?:^|[^{_WORD}])([A-Z]{{1,2}}{_DIGIT}[A-Z{_DIGIT}]?[{_SPACE}]*"
+               rf"{_DIGIT}[A-Z]{{2}})(?:[^{_WORD}]|$)")
+UPRN_RE     = rf"UPRN:[{_SPACE}]*({_DIGIT}+)"
+WHITESPACE  = "".join(c for c in map(chr, range(sys.maxunicode + 1)) if c.isspace())
+
+
+def backends():
+    """Backends this install can run (DuckDB is optional)."""
+    return [b for b in BACKENDS if b != "duckdb" or HAS_DUCKDB]
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def cleaning_query(columns, options):
+    """(sql, output columns) of Steps 1–7 over read_csv($path) for a CSV
+    with these `columns`.
+
+    The file is scanned once and grouped two ways at the same time: by
+    Parent task for the addresses, and by Name for the UPRN lookup. Each
+    result row is one cleaned address, numbered by its row in the file
+    (_first), and also carries the file's total and address row counts so
+    they come back even when no address survives.
+    """
+    parent_col, name_col, notes_col, found_custom_fields = resolve_columns(columns, options)
+    carried = [c for c in ["Task ID", *found_custom_fields] if c in columns]
+    uprn    = options.extract_uprn and notes_col and notes_col in columns
+    joined  = uprn and name_col and name_col in columns
+
+    scanned = [f"{_quote(parent_col)} AS _parent", *map(_quote, carried)]
+    grouped = [f"arg_min_null(nullif({_quote(c)}, ''), _row) AS {_quote(c)}" for c in carried]
+    sets    = "(_parent)"
+    if joined:
+        scanned += [f"{_quote(name_col)} AS _name",
+                    f"regexp_extract({_quote(notes_col)}, $uprn, 1) AS _uprn"]
+        grouped += ["max(_row) FILTER (WHERE _uprn <> '') AS _uprn_row",
+                    "arg_max(_uprn, _row) FILTER (WHERE _uprn <> '') AS _uprn"]
+        sets    += ", (_name)"
+
+    out_cols = (["Task ID"] if "Task ID" in carried else []) + ["Address", "Postcode"]
+    select   = [_quote(c) for c in out_cols if c == "Task ID"]
+    select  += ['_parent AS "Address"',
+                """left(compact, length(compact) - 3) || ' ' || right(compact, 3) AS "Postcode\""""]
+    if uprn:
+        out_cols.append("UPRN Number")
+        select.append("""coalesce(u._uprn, '') AS "UPRN Number\"""" if joined else """'' AS "UPRN Number\"""")
+    out_cols += [c for c in carried if c != "Task ID"]
+    select   += [_quote(c) for c in carried if c != "Task ID"]
+
+    uprn_cte = """,
+    uprns AS (   -- Step 4: Name → UPRN from Notes, the last match per name wins
+        SELECT trim(_name, $whitespace) AS _name, arg_max(_uprn, _uprn_row) AS _uprn
+        FROM groups
+        WHERE _by_name AND _uprn IS NOT NULL AND trim(_name, $whitespace) <> ''
+        GROUP BY 1
+    )""" if joined else ""
+
+    return f"""
+WITH
+    groups AS (
+        SELECT grouping(_parent) = 1 AS _by_name, _parent{", _name" if joined else ""},
+               min(_row) AS _first,
+               count(*) AS _rows{"".join(f",{chr(10)}               {g}" for g in grouped)}
+        FROM (
+            SELECT row_number() OVER () - 1 AS _row, {", ".join(scanned)}
+            FROM read_csv($path, header = true, all_varchar = true, nullstr = $nulls,
+                          delim = ',', quote = '"', escape = '"')
+        )
+        GROUP BY GROUPING SETS ({sets})
+    ),
+    addresses AS (   -- Steps 1–2: one regex pass per distinct Parent task, first row kept
+        SELECT *, replace(upper(regexp_extract(_parent, $postcode, 1)), ' ', '') AS compact
+        FROM groups
+        WHERE NOT _by_name
+    ),
+    totals AS (
+        SELECT coalesce(sum(_rows), 0)::BIGINT AS _original,
+               coalesce(sum(_rows) FILTER (WHERE compact <> ''), 0)::BIGINT AS _address_rows
+        FROM addresses
+    ){uprn_cte},
+    cleaned AS (   -- Steps 3 and 5–7: postcode, UPRN, custom fields, rename and order
+        SELECT _first, {", ".join(select)}
+        FROM addresses{" LEFT JOIN uprns u ON u._name = trim(_parent, $whitespace)" if joined else ""}
+        WHERE compact <> ''
+    )
+SELECT totals.*, cleaned.*
+FROM totals LEFT JOIN cleaned ON true
+ORDER BY _first
+""", out_cols
+
+
+def _run_query(path, sql, memory_limit=None):
+    """The cleaning query's result as an Arrow table, spilling to the temp dir."""
+    params = {
+        "path":       str(path),
+        "nulls":      sorted(STR_NA_VALUES),
+        "postcode":   POSTCODE_RE,
+        "uprn":       UPRN_RE,
+        "whitespace": WHITESPACE,
+    }
+    with duckdb.connect(config={"temp_directory": tempfile.gettempdir()}) as con:
+        con.execute("SET enable_progress_bar = false")
+        if memory_limit:
+            con.execute(f"SET memory_limit = '{memory_limit}'")
+        return con.execute(sql, {k: v for k, v in params.items() if f"${k}" in sql}) \
+                  .to_arrow_table()
+
+
+def clean_export_duckdb(path, options=None, memory_limit=None):
+    """clean_export_file for a CSV on disk, with Steps 1–7 run as one DuckDB query.
+
+    Returns (cleaned_df, stats, profiler) exactly as clean_export_file
+    would. `memory_limit` (e.g. "2GB") caps DuckDB's memory before it spills
+    to disk. Raises ValueError if there is no Parent task column.
+    """
+    if not HAS_DUCKDB:
+        raise ValueError("The duckdb backend needs duckdb installed.")
+    options = options or CleanOptions()
+    if is_xlsx(path):
+        return clean_export_file(path, options)
+    columns = read_header(path)
+    if len(set(columns)) != len(columns):
+        return clean_export_file(path, options)
+    parent_col, _, notes_col, found_custom_fields = resolve_columns(columns, options)
+    if not parent_col:
+        raise _missing_parent_error()
+
+    # Steps 1–7 — filter, dedup, postcode, UPRN, custom fields, rename, order
+    profiler = StageProfiler()
+    sql, out_cols = cleaning_query(columns, options)
+    with profiler.stage("duckdb") as stage:
+        table = _run_query(path, sql, memory_limit)
+        original_count = table["_original"][0].as_py()
+        before_dedup   = table["_address_rows"][0].as_py()
+        dtype = _arrow_string_dtype()
+        table = table.filter(table["_first"].is_valid())
+        index = pd.Index(table["_first"].to_numpy())
+        cleaned = table.select(out_cols).to_pandas(
+            types_mapper=lambda t: dtype if t in (pa.string(), pa.large_string()) else None
+        ).set_axis(index)
+        final_count   = len(cleaned)
+        dupes_removed = before_dedup - final_count
+        stage["rows_out"] = final_count
+
+    # Steps 2b, 3b and 4b — optional fuzzy dedup, ONSPD check, UPRNs by address
+    cleaned, post_stats = _post_clean(cleaned, "Address", options, profiler)
+    final_count = len(cleaned)
+
+    # Step 7 — the optional columns take their places in the final order
+    keep_cols = output_columns(columns, notes_col, found_custom_fields, options.extract_uprn,
+                               postcode_check_columns(options), bool(options.uprn_addresses))
+    return cleaned[keep_cols], {
+        "original_count": original_count,
+        "final_count":    final_count,
+        "dupes_removed":  dupes_removed,
+        "removed_count":  original_count - final_count,
+        **post_stats,
+    }, profiler
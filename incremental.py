@@ -0,0 +1,215 @@
+"""Incremental cleaning against a persisted index of earlier runs.
+
+Weekly re-exports of the same Asana project are almost entirely unchanged,
+so a local SQLite file remembers:
+
+* the normalised postcode of every Parent task string already seen,
+* per project, the UPRN found in each task's Notes, keyed by Task ID plus a
+  fingerprint of its Name and Notes, and
+* per project, the previous cleaned output keyed by Task ID and normalised
+  Address.
+
+clean_incremental() runs the postcode regex only on Parent task strings the
+index has never seen and the UPRN regex only on tasks whose Name or Notes
+changed, then diffs the new output against the last run's.
+"""
+import json
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from asana_cleaner import (
+    CleanOptions,
+    StageProfiler,
+    clean_asana_export,
+    extract_postcodes,
+    extract_uprns,
+    resolve_columns,
+)
+
+INDEX_PATH = os.environ.get("ASANA_CLEANER_INDEX", "asana_cleaner_index.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS postcodes (
+    address     TEXT PRIMARY KEY,
+    postcode    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS task_uprns (
+    project     TEXT NOT NULL,
+    task_id     TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    uprn        TEXT NOT NULL,
+    PRIMARY KEY (project, task_id)
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    project     TEXT NOT NULL,
+    row_key     TEXT NOT NULL,
+    row_hash    TEXT NOT NULL,
+    row_json    TEXT NOT NULL,
+    PRIMARY KEY (project, row_key)
+);
+"""
+
+
+def normalize_address_key(addresses):
+    """Case- and whitespace-insensitive form of an Address column."""
+    return addresses.str.upper().str.replace(r"\s+", " ", regex=True).str.strip()
+
+
+def _fingerprint(frame):
+    return pd.util.hash_pandas_object(frame, index=False).astype(str)
+
+
+class AddressIndex:
+    """SQLite store of earlier cleaning results; use as a context manager."""
+
+    def __init__(self, path=INDEX_PATH):
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def lookup_postcodes(self, addresses):
+        """{address: postcode} for the addresses already in the index."""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (address TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM wanted")
+        self.conn.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", ((a,) for a in addresses))
+        return dict(self.conn.execute(
+            "SELECT address, postcode FROM postcodes JOIN wanted USING (address)"))
+
+    def store_postcodes(self, postcodes):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO postcodes VALUES (?, ?)", postcodes.items())
+
+    def task_uprns(self, project):
+        return pd.read_sql_query(
+            "SELECT task_id, fingerprint, uprn FROM task_uprns WHERE project = ?",
+            self.conn, params=(project,), index_col="task_id")
+
+    def store_task_uprns(self, project, rows):
+        """Upsert (task_id, fingerprint, uprn) rows for `project`."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO task_uprns VALUES (?, ?, ?, ?)",
+                ((project, *row) for row in rows))
+
+    def previous_output(self, project):
+        return pd.read_sql_query(
+            "SELECT row_key, row_hash, row_json FROM outputs WHERE project = ?",
+            self.conn, params=(project,), index_col="row_key")
+
+    def replace_output(self, project, keys, hashes, cleaned):
+        rows = (json.dumps(r) for r in cleaned.fillna("").to_dict("records"))
+        with self.conn:
+            self.conn.execute("DELETE FROM outputs WHERE project = ?", (project,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)",
+                ((project, k, h, j) for k, h, j in zip(keys, hashes, rows)))
+
+
+def _cached_postcodes(index, parents):
+    """Postcode per row, running the regex only on unseen Parent task strings."""
+    unique = parents.dropna().unique()
+    known  = index.lookup_postcodes(unique)
+    fresh  = pd.Series([a for a in unique if a not in known], dtype=parents.dtype)
+    if len(fresh):
+        _, fresh_postcodes = extract_postcodes(fresh)
+        found = dict(zip(fresh, fresh_postcodes))
+        index.store_postcodes(found)
+        known.update(found)
+    return parents.map(known).fillna(""), len(unique) - len(fresh)
+
+
+def _cached_uprns(index, project, df, name_col, notes_col):
+    """extract_uprns(Notes) per row, reusing tasks whose Name/Notes are unchanged."""
+    task_ids     = df["Task ID"]
+    fingerprints = _fingerprint(df[[name_col, notes_col]])
+    previous     = index.task_uprns(project)
+    reuse        = task_ids.map(previous["fingerprint"]).eq(fingerprints)
+
+    stored = task_ids[reuse].map(previous["uprn"]).replace("", np.nan)
+    uprns  = pd.concat([stored, extract_uprns(df.loc[~reuse, notes_col])]).reindex(df.index)
+
+    changed = ~reuse & task_ids.notna()
+    index.store_task_uprns(project, zip(
+        task_ids[changed], fingerprints[changed], uprns[changed].fillna("")))
+    return uprns, int(reuse.sum())
+
+
+def diff_outputs(index, project, cleaned):
+    """Rows added, changed or removed since the project's last run.
+
+    Returns (changes_df, counts); changes_df has a leading Change column.
+    """
+    address_key = normalize_address_key(cleaned["Address"])
+    keys = (cleaned["Task ID"].fillna("") + "\x1f" + address_key
+            if "Task ID" in cleaned.columns else address_key)
+    hashes   = _fingerprint(cleaned)
+    previous = index.previous_output(project)
+
+    prev_hash = keys.map(previous["row_hash"])
+    added     = prev_hash.isna()
+    changed   = ~added & prev_hash.ne(hashes)
+    removed   = previous[~previous.index.isin(keys)]
+
+    changes = pd.concat([
+        cleaned[added].assign(Change="added"),
+        cleaned[changed].assign(Change="changed"),
+        pd.DataFrame([json.loads(j) for j in removed["row_json"]], columns=cleaned.columns)
+          .assign(Change="removed"),
+    ], ignore_index=True)
+    changes = changes[["Change"] + list(cleaned.columns)]
+
+    index.replace_output(project, keys, hashes, cleaned)
+    return changes, {
+        "added":   int(added.sum()),
+        "changed": int(changed.sum()),
+        "removed": len(removed),
+    }
+
+
+def clean_incremental(df, index, project, options=None, profiler=None):
+    """clean_asana_export, reusing `index` for unchanged rows.
+
+    Returns (cleaned_df, changes_df, stats); the cleaned output is identical
+    to a full clean. stats adds added/changed/removed counts and how many
+    postcodes and UPRNs came from the index.
+    """
+    options  = options or CleanOptions()
+    profiler = profiler or StageProfiler()
+    parent_col, name_col, notes_col, _ = resolve_columns(list(df.columns), options)
+
+    postcodes, postcodes_reused = None, 0
+    if parent_col:
+        with profiler.stage("postcode_index", rows_in=len(df)) as stage:
+            postcodes, postcodes_reused = _cached_postcodes(index, df[parent_col])
+            stage["rows_out"] = len(df)
+
+    uprns, uprns_reused = None, 0
+    if options.extract_uprn and name_col and notes_col and "Task ID" in df.columns:
+        with profiler.stage("uprn_index", rows_in=len(df)) as stage:
+            uprns, uprns_reused = _cached_uprns(index, project, df, name_col, notes_col)
+            stage["rows_out"] = len(df)
+
+    cleaned, stats = clean_asana_export(df, options, profiler, postcodes=postcodes, uprns=uprns)
+
+    with profiler.stage("diff", rows_in=len(cleaned)) as stage:
+        changes, counts = diff_outputs(index, project, cleaned)
+        stage["rows_out"] = len(changes)
+
+    return cleaned, changes, {
+        **stats,
+        **counts,
+        "postcodes_reused": postcodes_reused,
+        "uprns_reused":     uprns_reused,
+    }
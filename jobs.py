@@ -0,0 +1,201 @@
+"""Server-wide background queue for cleaning jobs.
+
+A Streamlit server is shared by several colleagues, and a few large cleans
+at once can exhaust its memory. Jobs are therefore queued FIFO and run on a
+fixed number of worker threads, and a job only starts while the memory
+reserved by the running jobs plus its own estimate stays within the
+server's budget (and, with other jobs running, within what the host still
+has available). A job bigger than the whole budget is refused up front.
+
+Each job publishes its current stage, chunk and rows read through a
+JobProfiler, so a polling UI can show live progress, and stops at the next
+stage (or chunk) boundary once cancelled.
+"""
+from collections import deque
+from contextlib import contextmanager
+import threading
+
+from asana_cleaner import StageProfiler, export_size
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+IN_MEMORY_FACTOR = 2     # parsed frame + cleaned frame, per byte of unpacked export
+STREAM_JOB_MB    = 128   # chunk buffers of a streaming clean, on top of the upload copy
+
+# In-memory stage order, for a progress fraction when the input isn't read in chunks
+STAGE_ORDER = ["read_csv", "postcode_index", "uprn_index", "filter", "dedup", "postcode",
+               "uprn", "fuzzy_dedup", "validate", "uprn_match", "custom_fields", "rename",
+               "reorder", "diff"]
+
+
+class JobCancelled(Exception):
+    """Raised inside a job's thread when the job has been cancelled."""
+
+
+def job_memory(data, streaming=False):
+    """Estimated peak memory of cleaning the upload `data`: its own copy plus,
+    in memory, frames sized by its unpacked text (an .xlsx holds far more than
+    its compressed size), or, streaming, the chunk buffers."""
+    if streaming:
+        return len(data) + STREAM_JOB_MB * 2**20
+    return len(data) + export_size(data) * IN_MEMORY_FACTOR
+
+
+def _available_bytes():
+    """MemAvailable from /proc/meminfo, or None where it can't be read."""
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class Job:
+    """One queued clean: `fn(job)` runs on a worker thread and returns the result."""
+
+    def __init__(self, fn, memory_bytes):
+        self.fn           = fn
+        self.memory_bytes = memory_bytes
+        self.state        = QUEUED
+        self.result       = None
+        self.error        = None
+        self.progress     = {"stage": None, "chunk": 0, "rows": 0, "fraction": 0.0}
+        self._cancelled   = threading.Event()
+
+    @property
+    def finished(self):
+        return self.state in FINISHED
+
+    @property
+    def cancel_requested(self):
+        return self._cancelled.is_set()
+
+    def update(self, **progress):
+        self.progress = {**self.progress, **progress}
+
+    def check_cancelled(self):
+        if self._cancelled.is_set():
+            raise JobCancelled()
+
+
+class JobQueue:
+    """FIFO of Jobs run by `workers` threads within a `memory_bytes` budget."""
+
+    def __init__(self, workers, memory_bytes):
+        self.memory_bytes  = memory_bytes
+        self.reserved      = 0
+        self._pending      = deque()
+        self._running      = set()
+        self._changed      = threading.Condition()
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"clean-job-{i}", daemon=True).start()
+
+    def submit(self, fn, memory_bytes):
+        """Queue `fn(job)`; raises ValueError if it could never fit the budget."""
+        if memory_bytes > self.memory_bytes:
+            raise ValueError(
+                f"This clean needs about {memory_bytes / 2**20:,.0f} MB, more than the "
+                f"server's {self.memory_bytes / 2**20:,.0f} MB job limit. "
+                f"Try low-memory streaming mode."
+            )
+        job = Job(fn, memory_bytes)
+        with self._changed:
+            self._pending.append(job)
+            self._changed.notify_all()
+        return job
+
+    def position(self, job):
+        """Number of jobs ahead of a queued `job`, or None once it has started."""
+        with self._changed:
+            try:
+                return self._pending.index(job)
+            except ValueError:
+                return None
+
+    def cancel(self, job):
+        """Drop a queued job, or stop a running one at its next stage or chunk."""
+        job._cancelled.set()
+        with self._changed:
+            if job in self._pending:
+                self._pending.remove(job)
+                job.state = CANCELLED
+                self._changed.notify_all()
+
+    def _admit(self):
+        """The head of the queue if it fits now; called with the lock held."""
+        if not self._pending:
+            return None
+        job = self._pending[0]
+        if self.reserved + job.memory_bytes > self.memory_bytes:
+            return None
+        available = _available_bytes()
+        if self._running and available is not None and available < job.memory_bytes:
+            return None
+        return self._pending.popleft()
+
+    def _next(self):
+        with self._changed:
+            while True:
+                job = self._admit()
+                if job is not None:
+                    self._running.add(job)
+                    self.reserved += job.memory_bytes
+                    job.state = RUNNING
+                    return job
+                # Host memory isn't signalled, so re-check it now and then
+                self._changed.wait(timeout=1.0)
+
+    def _work(self):
+        while True:
+            job = self._next()
+            try:
+                job.check_cancelled()
+                job.result = job.fn(job)
+                job.state  = DONE
+            except JobCancelled:
+                job.state = CANCELLED
+            except Exception as exc:  # surfaced to the session that submitted the job
+                job.error = exc
+                job.state = FAILED
+            finally:
+                with self._changed:
+                    self._running.discard(job)
+                    self.reserved -= job.memory_bytes
+                    self._changed.notify_all()
+
+
+class JobProfiler(StageProfiler):
+    """StageProfiler that reports every stage to `job` and stops it once cancelled.
+
+    Streaming cleans enter read_csv once per chunk; with the `source` stream
+    and its size, the fraction is how far through the file reading has got.
+    """
+
+    def __init__(self, job, source=None, size=None):
+        super().__init__()
+        self.job    = job
+        self.source = source
+        self.size   = size
+
+    def _fraction(self, name):
+        if self.source is not None and self.size:
+            if name == "read_csv":
+                return min(self.source.tell() / self.size, 1.0)
+        elif name in STAGE_ORDER:
+            return (STAGE_ORDER.index(name) + 1) / len(STAGE_ORDER)
+        return self.job.progress["fraction"]
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        self.job.check_cancelled()
+        self.job.update(stage=name)
+        with super().stage(name, rows_in) as current:
+            yield current
+        if name == "read_csv" and current["rows_out"]:
+            self.job.update(chunk=self.job.progress["chunk"] + 1,
+                            rows=self.job.progress["rows"] + current["rows_out"])
+        self.job.update(fraction=self._fraction(name))
@@ -0,0 +1,143 @@
+"""Offline postcode validation against the ONS Postcode Directory (ONSPD).
+
+The ONSPD CSV (~2.7M postcodes, over 1 GB) is compiled once into a sorted
+NumPy record array saved as .npy:
+
+    python postcode_index.py ONSPD_NOV_2025_UK.csv -o onspd_index.npy
+
+load_index() memory-maps that file instead of reading it, so it is ready in
+milliseconds and only the pages a lookup touches are ever paged in.
+Validating a column of postcodes is one vectorised binary search
+(np.searchsorted) over the sorted keys.
+"""
+import argparse
+import functools
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+INDEX_PATH = os.environ.get("ASANA_CLEANER_ONSPD", "onspd_index.npy")
+
+RECORD = np.dtype([
+    ("key",        "<u8"),   # postcode_keys() of the normalised postcode
+    ("terminated", "?"),
+    ("lad",        "S9"),    # local authority district code, e.g. b"E07000240"
+    ("lat",        "<i4"),   # micro-degrees; NO_COORDINATE when ONSPD has none
+    ("long",       "<i4"),
+])
+NO_COORDINATE = np.iinfo(np.int32).min
+ONSPD_NO_LAT  = 99.999999   # ONSPD's placeholder latitude for postcodes without a grid reference
+
+STATUS_COLUMN  = "Postcode Status"
+DETAIL_COLUMNS = ["Local Authority", "Latitude", "Longitude"]
+LIVE, TERMINATED, NOT_FOUND = "live", "terminated", "not found"
+
+
+def normalize_postcodes(values):
+    """Upper-case, single-spaced postcodes: the format of the Postcode column."""
+    compact = values.str.upper().str.replace(r"\s+", "", regex=True)
+    return compact.str[:-3] + " " + compact.str[-3:]
+
+
+def postcode_keys(postcodes):
+    """uint64 search keys: a postcode's 8 ASCII bytes read big-endian, so
+    integer order is string order and searchsorted compares machine words."""
+    padded = np.asarray(postcodes, dtype=object).astype("S8")
+    return padded.view(">u8").astype(np.uint64)
+
+
+def _onspd_columns(columns):
+    """(postcode, termination date, local authority, lat, long) column names."""
+    lower    = {c.lower(): c for c in columns}
+    postcode = next((lower[c] for c in ("pcds", "pcd2", "pcd") if c in lower), None)
+    lad      = lower.get("oslaua") or next(
+        (c for c in columns if re.fullmatch(r"lad\d{2}cd", c.lower())), None)
+    if not postcode or "doterm" not in lower:
+        raise ValueError("Not an ONS Postcode Directory CSV (needs pcds and doterm columns).")
+    return postcode, lower["doterm"], lad, lower.get("lat"), lower.get("long")
+
+
+def _micro_degrees(degrees, known):
+    return (degrees * 1_000_000).round().where(known, NO_COORDINATE).astype(np.int32)
+
+
+def compile_index(csv_path, index_path=INDEX_PATH):
+    """Build the sorted .npy index from an ONSPD CSV; returns the postcode count."""
+    postcode, doterm, lad, lat, long = _onspd_columns(pd.read_csv(csv_path, nrows=0).columns)
+    usecols = [c for c in (postcode, doterm, lad, lat, long) if c]
+    onspd   = pd.read_csv(csv_path, usecols=usecols, dtype=str, keep_default_na=False)
+
+    records = np.empty(len(onspd), RECORD)
+    records["key"]        = postcode_keys(normalize_postcodes(onspd[postcode]))
+    records["terminated"] = (onspd[doterm].str.strip() != "").to_numpy()
+    records["lad"]        = onspd[lad].to_numpy(dtype=object).astype("S9") if lad else b""
+    if lat and long:
+        lat_deg  = pd.to_numeric(onspd[lat], errors="coerce")
+        long_deg = pd.to_numeric(onspd[long], errors="coerce")
+        known    = lat_deg.notna() & long_deg.notna() & (lat_deg != ONSPD_NO_LAT)
+        records["lat"]  = _micro_degrees(lat_deg, known)
+        records["long"] = _micro_degrees(long_deg, known)
+    else:
+        records["lat"] = records["long"] = NO_COORDINATE
+
+    records = records[np.argsort(records["key"], kind="stable")]
+    np.save(index_path, records)
+    return len(records)
+
+
+@functools.lru_cache(maxsize=4)
+def _load(path, mtime):
+    return np.load(path, mmap_mode="r")
+
+
+def load_index(path=INDEX_PATH):
+    """The compiled index, memory-mapped once per process and file version."""
+    path = os.path.abspath(path)
+    return _load(path, os.path.getmtime(path))
+
+
+def _format_degrees(micro, found):
+    known = found & (micro != NO_COORDINATE)
+    return np.where(known, pd.Series(micro / 1_000_000).map("{:.6f}".format).to_numpy(), "")
+
+
+def lookup(index, postcodes, details=False):
+    """Status per postcode (live / terminated / not found), and with
+    `details` its local authority, latitude and longitude.
+
+    `postcodes` is a Series in the Postcode column's format; returns a
+    DataFrame of strings aligned to it, blank where nothing is known.
+    """
+    keys = postcode_keys(postcodes.fillna(""))
+    if len(index):
+        records = index[np.searchsorted(index["key"], keys).clip(max=len(index) - 1)]
+        found   = records["key"] == keys
+    else:
+        records = np.zeros(len(keys), RECORD)
+        found   = np.zeros(len(keys), dtype=bool)
+
+    columns = {STATUS_COLUMN: np.where(
+        found, np.where(records["terminated"], TERMINATED, LIVE), NOT_FOUND)}
+    if details:
+        columns["Local Authority"] = np.where(found, records["lad"].astype(str), "")
+        columns["Latitude"]        = _format_degrees(records["lat"], found)
+        columns["Longitude"]       = _format_degrees(records["long"], found)
+    return pd.DataFrame(columns, index=postcodes.index)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile an ONSPD CSV into a postcode index.")
+    parser.add_argument("onspd_csv", help="ONS Postcode Directory CSV (the full UK file)")
+    parser.add_argument("-o", "--output", default=INDEX_PATH,
+                        help=f"index file to write (default: {INDEX_PATH})")
+    args  = parser.parse_args(argv)
+    count = compile_index(args.onspd_csv, args.output)
+    print(f"Indexed {count:,} postcodes into {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""Byte-capped LRU cache for parsed uploads and cleaned results.
+
+Keys are built from the upload's content hash plus the cleaning options, so
+a Streamlit rerun (theme toggle, checkbox, download click) or a second upload
+of the same export is answered from memory instead of being re-parsed and
+re-cleaned.
+"""
+from collections import OrderedDict
+import hashlib
+import sys
+import threading
+
+import pandas as pd
+
+
+def content_digest(data):
+    """SHA-256 hex digest of an upload's bytes (or any buffer)."""
+    return hashlib.sha256(memoryview(data)).hexdigest()
+
+
+def estimate_nbytes(value):
+    """Rough resident size of a cached value, used for the memory cap."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_nbytes(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """Thread-safe LRU mapping that evicts oldest entries past `max_bytes`.
+
+    Values bigger than the whole budget are not stored at all, so one huge
+    export can't flush everything else out.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes  = max_bytes
+        self.used_bytes = 0
+        self._entries   = OrderedDict()   # key -> (value, nbytes)
+        self._lock      = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, nbytes=None):
+        """Store `value`; returns False if it alone exceeds the budget."""
+        nbytes = estimate_nbytes(value) if nbytes is None else nbytes
+        with self._lock:
+            if key in self._entries:
+                self.used_bytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return False
+            self._entries[key] = (value, nbytes)
+            self.used_bytes   += nbytes
+            while self.used_bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.used_bytes -= evicted
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
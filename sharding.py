@@ -0,0 +1,189 @@
+"""Run a column-wise regex over shards of a large string column on all cores.
+
+pandas' string methods use one core. apply_sharded() splits a large column
+into contiguous shards and runs the same function on each in a process
+pool. The column's Arrow buffers (offsets, UTF-8 data and validity bitmap)
+are copied once into a SharedMemory block, and each worker copies just its
+own slice back out. Only the shard bounds travel to the workers, and only
+the (much smaller) results come back.
+
+Shard results are concatenated in shard order, and the function is
+row-wise, so the output is identical to calling it on the whole column.
+Small columns, columns that aren't Arrow-backed and calls from inside a
+worker process take the serial path, since there pool startup and the
+copy would cost more than they save.
+
+The workers are spawned rather than forked, which would copy the caller's
+threads, and start without importing __main__: under `streamlit run` that
+is the app script, which a spawned worker would otherwise run again in
+full. spawn_pool() builds such a pool, and the Streamlit app uses it for
+its multi-file cleans too.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+import functools
+import multiprocessing
+import os
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+SHARD_WORKERS    = int(os.environ.get("ASANA_CLEANER_REGEX_WORKERS", os.cpu_count() or 1))
+SHARD_MIN_VALUES = 250_000   # columns shorter than this stay serial
+SHARD_MIN_ROWS   = 50_000    # no shard smaller than this
+
+
+def shard_bounds(n, workers=None):
+    """(start, stop) of each shard of an `n`-row column; one shard means serial."""
+    workers = SHARD_WORKERS if workers is None else workers
+    if n < SHARD_MIN_VALUES or workers < 2:
+        return [(0, n)]
+    count = max(1, min(workers, n // SHARD_MIN_ROWS))
+    edges = np.linspace(0, n, count + 1).astype(int)
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def _shardable(series):
+    return (HAS_PYARROW
+            and isinstance(series.dtype, pd.StringDtype)
+            and series.dtype.storage == "pyarrow"
+            and multiprocessing.parent_process() is None)
+
+
+_main_lock = threading.Lock()
+
+
+@contextmanager
+def _main_hidden():
+    """Hide __main__'s file and spec, from which spawned processes re-import it."""
+    main = sys.modules["__main__"]
+    with _main_lock:
+        saved = {attr: main.__dict__[attr] for attr in ("__file__", "__spec__")
+                 if attr in main.__dict__}
+        main.__dict__.pop("__file__", None)
+        main.__spec__ = None
+        try:
+            yield
+        finally:
+            main.__dict__.pop("__spec__", None)
+            main.__dict__.update(saved)
+
+
+class _SpawnPool(ProcessPoolExecutor):
+    # Workers are started inside submit(), as tasks arrive
+    def submit(self, fn, /, *args, **kwargs):
+        with _main_hidden():
+            return super().submit(fn, *args, **kwargs)
+
+
+def spawn_pool(max_workers):
+    """Process pool whose spawned workers don't re-run the caller's __main__;
+    tasks must be module-level functions of importable modules."""
+    return _SpawnPool(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+@functools.lru_cache(maxsize=1)
+def _pool():
+    """Shard workers, started on first use."""
+    return spawn_pool(SHARD_WORKERS)
+
+
+def _to_shared(series):
+    """Copy a string column's Arrow buffers into one SharedMemory block.
+
+    Returns (block, layout): layout holds each buffer's (offset, nbytes)
+    within the block, None for a missing validity bitmap.
+    """
+    array = pa.array(series.array, from_pandas=True)
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    array = array.cast(pa.large_string())
+    validity, offsets, data = array.buffers()
+    parts  = [offsets, data] + ([validity] if validity is not None else [])
+    block  = shared_memory.SharedMemory(create=True, size=max(1, sum(p.size for p in parts)))
+    layout, position = [], 0
+    try:
+        for part in parts:
+            block.buf[position:position + part.size] = memoryview(part).cast("B")
+            layout.append((position, part.size))
+            position += part.size
+    except BaseException:
+        block.close()
+        block.unlink()
+        raise
+    if validity is None:
+        layout.append(None)
+    return block, (array.offset, len(array), layout)
+
+
+def _buffer(block, part):
+    if part is None:
+        return None
+    position, size = part
+    return pa.py_buffer(block.buf[position:position + size])
+
+
+def _run_shard(fn, block_name, layout, start, stop, dtype):
+    """Worker: rebuild rows [start, stop) from shared memory and apply `fn`."""
+    # Spawned workers share the parent's resource tracker, so attaching here
+    # doesn't take ownership: the parent still unlinks the block
+    block = shared_memory.SharedMemory(name=block_name)
+    try:
+        offset, _, (offsets, data, validity) = layout
+        view = pa.LargeStringArray.from_buffers(
+            stop - start, _buffer(block, offsets), _buffer(block, data),
+            _buffer(block, validity), offset=offset + start)
+        # Copy the shard out: the block can't close while anything still views
+        # it, and the Series pandas builds may keep the buffers it was given
+        array = pa.concat_arrays([view])
+        del view
+    finally:
+        block.close()
+    return fn(pd.Series(array.to_pandas(types_mapper=lambda t: dtype)))
+
+
+def _concat(parts, index):
+    """Join shard results (Series, or tuples of Series) back onto `index`."""
+    if isinstance(parts[0], tuple):
+        return tuple(_concat(list(column), index) for column in zip(*parts))
+    return pd.concat(parts, ignore_index=True).set_axis(index)
+
+
+def apply_sharded(fn, series):
+    """fn(series) for a row-wise `fn` returning a Series or a tuple of Series,
+    run over shards in parallel when the column is large enough.
+
+    `fn` must be a module-level function so the workers can import it.
+    """
+    bounds = shard_bounds(len(series))
+    if len(bounds) == 1 or not _shardable(series):
+        return fn(series)
+    block, layout = _to_shared(series)
+    try:
+        try:
+            parts = _run_shards(fn, block, layout, bounds, series.dtype)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory): start a fresh pool and retry once
+            _pool().shutdown(wait=False, cancel_futures=True)
+            _pool.cache_clear()
+            parts = _run_shards(fn, block, layout, bounds, series.dtype)
+        return _concat(parts, series.index)
+    finally:
+        block.close()
+        block.unlink()
+
+
+def _run_shards(fn, block, layout, bounds, dtype):
+    futures = [_pool().submit(_run_shard, fn, block.name, layout, start, stop, dtype)
+               for start, stop in bounds]
+    return [future.result() for future in futures]
@@ -0,0 +1,63 @@
+"""batch_clean.py end to end on a small folder of exports."""
+import csv
+
+import openpyxl
+import pytest
+
+import batch_clean
+
+ROWS = [
+    ["Task ID", "Name", "Notes", "Parent task"],
+    ["1", "1 High St, AB1 2CD", "UPRN: 111", ""],
+    ["2", "Survey", "", "1 High St, AB1 2CD"],
+    ["3", "Install", "", "2 Low Rd, EF3 4GH"],
+]
+
+
+def _write_csv(path, rows):
+    with open(path, "w", newline="") as f:
+        csv.writer(f).writerows(rows)
+
+
+def _write_xlsx(path, rows):
+    book = openpyxl.Workbook()
+    for row in rows:
+        book.active.append([value or None for value in row])
+    book.save(path)
+
+
+def test_exports_sharing_a_stem_get_separate_outputs(tmp_path):
+    exports = tmp_path / "exports"
+    exports.mkdir()
+    _write_csv(exports / "x.csv", ROWS)
+    _write_xlsx(exports / "x.xlsx", ROWS[:3])
+    _write_csv(exports / "y.csv", ROWS)
+    out = tmp_path / "out"
+
+    assert batch_clean.main([str(exports), "-o", str(out), "-w", "1"]) == 0
+    assert sorted(p.name for p in out.iterdir()) == [
+        "cleaned_x.csv.csv", "cleaned_x.xlsx.csv", "cleaned_y.csv"]
+    with open(out / "cleaned_x.xlsx.csv") as f:
+        assert sum(1 for _ in f) == 2   # header + the one address in the workbook
+
+
+def test_incremental_projects_keep_sharing_exports_apart(tmp_path):
+    exports = tmp_path / "exports"
+    exports.mkdir()
+    _write_csv(exports / "x.csv", ROWS)
+    _write_xlsx(exports / "x.xlsx", ROWS[:3])
+    out = tmp_path / "out"
+    index = tmp_path / "index.db"
+
+    argv = [str(exports), "-o", str(out), "-w", "1", "--incremental", str(index)]
+    assert batch_clean.main(argv) == 0
+    assert batch_clean.main(argv) == 0
+    for name in ("x.csv", "x.xlsx"):   # nothing changed since each file's own last run
+        with open(out / f"changes_{name}.csv") as f:
+            assert sum(1 for _ in f) == 1
+
+
+def test_no_uprn_with_uprn_addresses_is_rejected(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        batch_clean.parse_args([str(tmp_path), "--no-uprn", "--uprn-addresses", "ref.csv"])
+    assert "--no-uprn" in capsys.readouterr().err
@@ -0,0 +1,48 @@
+"""The DuckDB backend returns the pandas backend's frame, dtypes and stats."""
+import pandas as pd
+import pytest
+
+from asana_cleaner import CleanOptions, clean_export_file
+from duckdb_backend import HAS_DUCKDB, clean_export_duckdb
+
+pytestmark = pytest.mark.skipif(not HAS_DUCKDB, reason="duckdb is not installed")
+
+BLANK_UPRNS = """Task ID,Name,Notes,Parent task
+1,1 High St AB1 2CD,,
+2,Survey,no uprn here,1 High St AB1 2CD
+3,Fit,,2 Low Rd AB1 2CE
+4,Fit,,2 Low Road AB1 2CE
+"""
+NO_ADDRESSES = """Task ID,Name,Notes,Parent task
+1,Survey,,no postcode
+"""
+REFERENCE = """UPRN,ADDRESS,POSTCODE
+10000000001,1 ALBERT CLOSE,HW70 2MX
+"""
+
+
+def _assert_same(path, options):
+    expected, expected_stats, _ = clean_export_file(path, options)
+    cleaned, stats, _           = clean_export_duckdb(path, options)
+    pd.testing.assert_frame_equal(cleaned, expected)
+    if "fuzzy_merges" in expected_stats:
+        pd.testing.assert_frame_equal(stats.pop("fuzzy_merges"),
+                                      expected_stats.pop("fuzzy_merges"))
+    assert stats == expected_stats
+
+
+@pytest.mark.parametrize("export", [BLANK_UPRNS, NO_ADDRESSES], ids=["blank-uprns", "empty"])
+@pytest.mark.parametrize("fuzzy_dedup", [False, True])
+@pytest.mark.parametrize("uprn_addresses", [False, True])
+def test_no_uprns_match_pandas_backend(tmp_path, export, fuzzy_dedup, uprn_addresses):
+    path = tmp_path / "export.csv"
+    path.write_text(export)
+    reference = None
+    if uprn_addresses:
+        reference = tmp_path / "addresses.csv"
+        reference.write_text(REFERENCE)
+    options = CleanOptions(fuzzy_dedup=fuzzy_dedup,
+                           uprn_addresses=reference and str(reference))
+    cleaned, _, _ = clean_export_duckdb(path, options)
+    assert (cleaned["UPRN Number"] == "").all()
+    _assert_same(path, options)
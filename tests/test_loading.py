@@ -0,0 +1,111 @@
+"""Loading exports, including on installs without the optional pyarrow."""
+import csv
+import io
+import subprocess
+import sys
+import zipfile
+from pathlib import Path
+
+import openpyxl
+import pytest
+
+from asana_cleaner import export_size
+from jobs import IN_MEMORY_FACTOR, job_memory
+
+ROOT = Path(__file__).resolve().parent.parent
+
+ROWS = [
+    ["Task ID", "Name", "Notes", "Parent task"],
+    ["1", "1 High St, AB1 2CD", "UPRN: 111", None],
+    ["2", "Survey", None, "1 High St, AB1 2CD"],
+    ["3", "Install", None, "1 High St, AB1 2CD"],
+]
+
+# Custom-field cells left blank in the workbook
+BLANK_CELLS = [
+    ["Task ID", "Name", "Notes", "Parent task", "Dodds Group", "Watford Low Rise"],
+    ["1", "Survey", None, "1 High St, AB1 2CD", "x", None],
+    ["2", "Survey", None, "2 Low Rd, AB1 2CE", None, None],
+    ["3", "Survey", None, "3 Mill Ln, AB1 2CF", None, "y"],
+]
+
+# A meta-path hook rather than sys.modules['pyarrow'] = None, which pandas'
+# compiled modules read as an installed pyarrow
+BLOCK_PYARROW = """import sys
+class _Blocked:
+    def find_spec(self, name, path=None, target=None):
+        if name.partition(".")[0] == "pyarrow":
+            raise ImportError(f"No module named {name!r}")
+sys.meta_path.insert(0, _Blocked())
+"""
+
+
+def _workbook(path, rows=ROWS):
+    book  = openpyxl.Workbook()
+    sheet = book.active
+    for row in rows:
+        sheet.append(row)
+    book.save(path)
+    return path
+
+
+def _run(code, pyarrow=True):
+    """Run `code` in a fresh interpreter, optionally where importing pyarrow fails."""
+    prelude = "" if pyarrow else BLOCK_PYARROW
+    return subprocess.run([sys.executable, "-c", prelude + code], cwd=ROOT,
+                          capture_output=True, text=True)
+
+
+def _run_without_pyarrow(code):
+    return _run(code, pyarrow=False)
+
+
+def test_xlsx_loads_and_cleans_without_pyarrow(tmp_path):
+    path   = _workbook(tmp_path / "export.xlsx")
+    result = _run_without_pyarrow(
+        "from asana_cleaner import HAS_PYARROW, clean_export_file, read_export\n"
+        f"df = read_export({str(path)!r})\n"
+        f"cleaned, stats, _ = clean_export_file({str(path)!r})\n"
+        "print(HAS_PYARROW, len(df), stats['final_count'], cleaned['UPRN Number'].tolist())\n"
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split("\n")[0] == "False 3 1 ['111']"
+
+
+@pytest.mark.parametrize("pyarrow", [True, False], ids=["pyarrow", "no-pyarrow"])
+def test_blank_xlsx_cells_stay_missing(tmp_path, pyarrow):
+    xlsx = _workbook(tmp_path / "export.xlsx", BLANK_CELLS)
+    with open(tmp_path / "export.csv", "w", newline="") as f:
+        csv.writer(f).writerows(BLANK_CELLS)
+    result = _run(
+        "from asana_cleaner import clean_export_file, output_bytes, read_export\n"
+        f"df = read_export({str(xlsx)!r})\n"
+        "print(df[['Dodds Group', 'Watford Low Rise']].isna().to_numpy().tolist())\n"
+        "for name in ('export.xlsx', 'export.csv'):\n"
+        f"    cleaned, _, _ = clean_export_file({str(tmp_path)!r} + '/' + name)\n"
+        "    print(output_bytes(cleaned, 'csv'))\n",
+        pyarrow,
+    )
+    assert result.returncode == 0, result.stderr
+    missing, from_xlsx, from_csv = result.stdout.splitlines()
+    assert missing == "[[False, True], [True, True], [True, False]]"
+    assert from_xlsx == from_csv
+    assert "None" not in from_xlsx
+
+
+def test_xlsx_export_size_is_its_unpacked_size(tmp_path):
+    path = _workbook(tmp_path / "export.xlsx")
+    data = path.read_bytes()
+    with zipfile.ZipFile(path) as book:
+        unpacked = sum(part.file_size for part in book.infolist())
+    assert export_size(path) == export_size(data) == unpacked > len(data)
+    assert job_memory(data) == len(data) + unpacked * IN_MEMORY_FACTOR
+
+
+def test_csv_export_size_is_its_file_size(tmp_path):
+    path   = tmp_path / "export.csv"
+    path.write_text("\n".join(",".join(cell or "" for cell in row) for row in ROWS))
+    stream = io.BytesIO(path.read_bytes())
+    stream.read(5)
+    assert export_size(path) == export_size(stream) == path.stat().st_size
+    assert stream.tell() == 0
@@ -0,0 +1,51 @@
+"""Worker pools: spawned workers skip __main__, and a broken pool is rebuilt."""
+import os
+import subprocess
+import sys
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+import pytest
+
+import sharding
+from asana_cleaner import HAS_PYARROW, _postcode_matches
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APP = """
+import os, sys
+with open(sys.argv[1], "a") as marker:   # top-level work, like a Streamlit script
+    marker.write(f"{os.getpid()}\\n")
+if __name__ == "__main__":
+    from sharding import spawn_pool
+    with spawn_pool(2) as pool:
+        print(sorted({pool.submit(os.getpid).result() for _ in range(4)} - {os.getpid()}))
+"""
+
+
+def test_spawned_workers_do_not_rerun_main(tmp_path):
+    script, marker = tmp_path / "app.py", tmp_path / "runs.txt"
+    script.write_text(APP)
+    result = subprocess.run([sys.executable, str(script), str(marker)], capture_output=True,
+                            text=True, env={**os.environ, "PYTHONPATH": ROOT})
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() != "[]"
+    assert len(marker.read_text().split()) == 1
+
+
+@pytest.mark.skipif(not HAS_PYARROW, reason="sharding needs pyarrow")
+def test_broken_pool_is_rebuilt(monkeypatch):
+    monkeypatch.setattr(sharding, "SHARD_WORKERS", 2)
+    sharding._pool.cache_clear()
+    with pytest.raises(BrokenProcessPool):
+        sharding._pool().submit(os._exit, 1).result()
+
+    series = pd.Series(["1 High St, AB1 2CD", "no postcode"] * 150_000,
+                       dtype=pd.StringDtype("pyarrow"))
+    try:
+        sharded = sharding.apply_sharded(_postcode_matches, series)
+        for got, expected in zip(sharded, _postcode_matches(series)):
+            pd.testing.assert_series_equal(got, expected)
+    finally:
+        sharding._pool().shutdown()
+        sharding._pool.cache_clear()